@@ -3,21 +3,22 @@ PSYWARD Document Management System
 HIPAA-compliant medical records system optimized for Raspberry Pi Zero
 """
 import os
+import re
 import logging
 from typing import Optional
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from flask_login import LoginManager
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from flask_talisman import Talisman
-from cryptography.fernet import Fernet
 import redis
 
 # Initialize extensions
 db = SQLAlchemy()
 login_manager = LoginManager()
 limiter = Limiter(key_func=get_remote_address)
+redis_client: Optional[redis.Redis] = None  # Set up in create_app
 
 # Configure logging
 logging.basicConfig(
@@ -30,9 +31,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Security headers are static, so build them once instead of per response.
+# HTTPS redirection is handled by nginx in front of gunicorn.
+_SECURITY_HEADERS = {
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+    'Content-Security-Policy': "default-src 'self'; object-src 'none'",
+    'X-Frame-Options': 'SAMEORIGIN',
+    'X-Content-Type-Options': 'nosniff',
+    'Referrer-Policy': 'strict-origin-when-cross-origin'
+}
 
-def create_app(config_name: str = 'production') -> Flask:
-    """Create and configure the Flask application"""
+# SQLite tuning for SD card: WAL + NORMAL sync means far fewer fsyncs
+# while staying crash-safe; mmap/cache keep hot pages out of syscalls
+_SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('cache_size', -8000),  # KiB
+    ('temp_store', 'MEMORY'),
+)
+
+# PHI display redaction: SSN or MRN (assumed 6-10 digits) in one pass
+_PHI_RE = re.compile(r'\b(?P<ssn>\d{3}-\d{2}-\d{4})\b|\b(?P<mrn>\d{6,10})\b')
+
+
+def create_app(config_name: str = 'production', start_samplers: bool = True) -> Flask:
+    """Create and configure the Flask application (CLI scripts skip the samplers)"""
     app = Flask(__name__)
     
     # Load configuration
@@ -48,9 +72,13 @@ def create_app(config_name: str = 'production') -> Flask:
     login_manager.init_app(app)
     limiter.init_app(app)
     
+    # Shared Redis connection (connects lazily on first command)
+    global redis_client
+    redis_client = redis.Redis.from_url(app.config.get('REDIS_URL', 'redis://localhost:6379/0'))
+    
     # Security headers
     if config_name == 'production':
-        Talisman(app, force_https=True, strict_transport_security=True)
+        app.after_request(_apply_security_headers)
     
     # Configure login manager
     login_manager.login_view = 'auth.login'
@@ -71,22 +99,99 @@ def create_app(config_name: str = 'production') -> Flask:
     
     # Create database tables
     with app.app_context():
+        _configure_sqlite(db.engine)
         db.create_all()
+        from app.patient.models import (
+            ensure_added_columns, ensure_document_fts, backfill_patient_search_names
+        )
+        ensure_added_columns(db.engine)
+        ensure_document_fts(db.engine)
+        backfill_patient_search_names()
         _initialize_encryption_keys()
     
+    # Report which AEAD this CPU gets for file encryption
+    from app.auth.security import ALGORITHM_NAMES, DEFAULT_FILE_ALGORITHM
+    logger.info(f"File encryption: {ALGORITHM_NAMES[DEFAULT_FILE_ALGORITHM]}")
+    
     # Register error handlers
     register_error_handlers(app)
     
+    # Register request hooks
+    register_request_hooks(app)
+    
+    # Optional per-endpoint profiling
+    if os.environ.get('ENABLE_FMD'):
+        _init_monitoring_dashboard(app)
+    
     # Register template filters
     register_template_filters(app)
     
+    # Start background metric samplers for the admin dashboard
+    if start_samplers:
+        from app.admin.dashboard import start_metrics_samplers
+        start_metrics_samplers(app)
+    
+    # Purge expired sessions periodically instead of per request
+    from app.auth.security import start_session_cleanup
+    start_session_cleanup(app)
+    
+    # Write document view counters in batches, not one commit per view
+    from app.patient.models import start_access_flush, start_access_log_writer
+    start_access_flush(app)
+    
+    # Patient access logging off the request path (drained again at exit)
+    start_access_log_writer(app)
+    
     return app
 
 
+def _apply_security_headers(response):
+    """Add precomputed security headers to response"""
+    response.headers.update(_SECURITY_HEADERS)
+    return response
+
+
+def _configure_sqlite(engine):
+    """Apply SQLite PRAGMAs to every new connection"""
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in _SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+    
+    with engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+    logger.info(f"SQLite journal mode: {journal_mode}")
+
+
+def _init_monitoring_dashboard(app: Flask):
+    """Bind Flask-MonitoringDashboard for profiling (enabled via ENABLE_FMD)"""
+    try:
+        import flask_monitoringdashboard as dashboard
+    except ImportError:
+        logger.warning("ENABLE_FMD set but flask_monitoringdashboard is not installed")
+        return
+    
+    if os.environ.get('FMD_CONFIG'):
+        dashboard.config.init_from(envvar='FMD_CONFIG')
+    
+    # Keep profiler data out of the main database so they never contend
+    dashboard.config.database_name = app.config.get(
+        'FMD_DATABASE_URI', 'sqlite:////mnt/encrypted_data/fmd.db'
+    )
+    dashboard.bind(app)
+    logger.info("Flask-MonitoringDashboard enabled")
+
+
 def _initialize_encryption_keys():
     """Initialize master encryption key if not exists"""
     key_path = os.environ.get('MASTER_KEY_PATH', '/etc/psyward/keys/master.key')
     if not os.path.exists(key_path):
+        from cryptography.fernet import Fernet
         os.makedirs(os.path.dirname(key_path), exist_ok=True)
         key = Fernet.generate_key()
         with open(key_path, 'wb') as f:
@@ -111,15 +216,29 @@ def register_error_handlers(app: Flask):
         return {'error': 'Internal server error'}, 500
 
 
+def register_request_hooks(app: Flask):
+    """Register per-request hooks"""
+    
+    @app.after_request
+    def commit_session(response):
+        """Commit writes queued during the request in one transaction (one fsync)"""
+        if response.status_code < 500:
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Deferred commit failed: {str(e)}")
+                raise
+        return response
+
+
 def register_template_filters(app: Flask):
     """Register custom Jinja2 filters"""
     
     @app.template_filter('redact_phi')
     def redact_phi(text: str) -> str:
         """Redact PHI from text for display"""
-        import re
-        # SSN pattern
-        text = re.sub(r'\b\d{3}-\d{2}-\d{4}\b', 'XXX-XX-XXXX', text)
-        # MRN pattern (assumed 6-10 digits)
-        text = re.sub(r'\b\d{6,10}\b', 'XXXXXXXXXX', text)
-        return text
\ No newline at end of file
+        return _PHI_RE.sub(
+            lambda m: 'XXX-XX-XXXX' if m.group('ssn') else 'XXXXXXXXXX',
+            text
+        )
\ No newline at end of file
@@ -1,21 +1,73 @@
 """System monitoring and admin dashboard"""
 import os
+import re
+import time
 import psutil
 import subprocess
+import threading
+import orjson
+import redis
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from flask import Blueprint, render_template, jsonify, current_app
 from flask_login import login_required, current_user
-from app import db
+from sqlalchemy import select, func
+from app import db, logger
 from app.auth.models import User, Role, UserSession
 from app.patient.models import Patient, PatientDocument
 from app.audit.logger import get_audit_logger
-from app.documents.storage import PatientStorageManager
+from app.auth.security import ALGORITHM_NAMES, DEFAULT_FILE_ALGORITHM
+from app.documents.storage import PatientStorageManager, scan_tree
 from config.constraints import PI_ZERO_LIMITS
 
 
 admin_bp = Blueprint('admin', __name__)
 
+# Metrics are cached briefly so dashboard polling doesn't hammer the Pi Zero
+_CACHE_TTL = 10.0
+_metrics_cache = {'ts': 0, 'value': None}
+_app_metrics_cache = {'ts': 0, 'value': None}
+_security_cache = {'ts': 0, 'value': None}
+
+# Walking the patient tree is slow on SD cards, so cache it longer
+_STORAGE_CACHE_TTL = 60.0
+_storage_cache = {'ts': 0, 'value': None}
+
+# Backup archives are named psyward_backup_<YYYYmmdd_HHMMSS>.enc
+_BACKUP_NAME_RE = re.compile(r'^psyward_backup_(\d{8}_\d{6})\.enc$')
+
+# Background sampling (keeps blocking calls and forks off the request thread)
+CPU_SAMPLE_INTERVAL = 2.0  # seconds
+SD_HEALTH_INTERVAL = 15 * 60  # seconds
+THROTTLED_PATH = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+_latest_cpu = {'percent': None}
+_sd_health = {'healthy': True, 'lifetime_writes_gb': 0, 'wear_level': 'unknown'}
+
+# Audit chain is verified incrementally, resuming after the last checked entry
+AUDIT_VERIFY_INTERVAL = 60 * 60  # seconds
+_audit_integrity = {'issues_count': 0, 'last_verified': None}
+_sampler_stop = threading.Event()
+
+# Full status snapshot published to Redis so requests don't collect it
+METRICS_KEY = 'metrics:latest'
+METRICS_PUBLISH_INTERVAL = 10.0  # seconds
+METRICS_KEY_TTL = 30  # seconds
+_sampler_threads: List[threading.Thread] = []
+
+
+def _get_cached(cache: Dict[str, Any], collect, ttl: float = _CACHE_TTL) -> Any:
+    """Return cached metrics if still fresh, otherwise collect and cache them"""
+    now = time.monotonic()
+    if cache['value'] is not None and now - cache['ts'] < ttl:
+        return cache['value']
+    
+    value = collect()
+    # Don't cache failures so the next poll retries
+    if value is not None and value != {}:
+        cache['value'] = value
+        cache['ts'] = now
+    return value
+
 
 @admin_bp.before_request
 @login_required
@@ -35,6 +87,11 @@ def dashboard():
 @admin_bp.route('/api/system/status')
 def system_status():
     """Real-time system status API"""
+    # Serve the published snapshot as-is when available
+    snapshot = _read_metrics_snapshot()
+    if snapshot is not None:
+        return current_app.response_class(snapshot, mimetype='application/json')
+    
     status = {
         'timestamp': datetime.utcnow().isoformat(),
         'system': get_system_metrics(),
@@ -44,11 +101,45 @@ def system_status():
     return jsonify(status)
 
 
+def collect_metrics() -> Dict[str, Any]:
+    """Collect a fresh full status snapshot (bypasses the TTL caches)"""
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'system': _collect_system_metrics(),
+        'application': _collect_application_metrics(),
+        'security': _collect_security_status()
+    }
+
+
+def publish_metrics():
+    """Collect metrics and store the serialized snapshot in Redis"""
+    from app import redis_client
+    payload = orjson.dumps(collect_metrics())
+    redis_client.setex(METRICS_KEY, METRICS_KEY_TTL, payload)
+
+
+def _read_metrics_snapshot() -> Optional[bytes]:
+    """Get the latest published snapshot, or None if missing/unreachable"""
+    from app import redis_client
+    if redis_client is None:
+        return None
+    try:
+        return redis_client.get(METRICS_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Metrics snapshot unavailable: {str(e)}")
+        return None
+
+
 def get_system_metrics() -> Dict[str, Any]:
     """Get Raspberry Pi system metrics"""
+    return _get_cached(_metrics_cache, _collect_system_metrics)
+
+
+def _collect_system_metrics() -> Dict[str, Any]:
+    """Collect Raspberry Pi system metrics"""
     try:
-        # CPU usage
-        cpu_percent = psutil.cpu_percent(interval=1)
+        # CPU usage (latest background sample)
+        cpu_percent = _latest_cpu['percent']
         
         # Memory usage
         memory = psutil.virtual_memory()
@@ -104,33 +195,33 @@ def get_system_metrics() -> Dict[str, Any]:
 
 def get_application_metrics() -> Dict[str, Any]:
     """Get application-specific metrics"""
+    return _get_cached(_app_metrics_cache, _collect_application_metrics)
+
+
+def _collect_application_metrics() -> Dict[str, Any]:
+    """Collect application-specific metrics"""
     try:
         # Database size
         db_path = current_app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
         db_size_mb = os.path.getsize(db_path) / (1024 * 1024) if os.path.exists(db_path) else 0
         
-        # Record counts
-        patient_count = Patient.query.count()
-        document_count = PatientDocument.query.count()
-        user_count = User.query.count()
-        active_sessions = UserSession.query.filter(
-            UserSession.expires_at > datetime.utcnow()
-        ).count()
+        # Record counts, recent activity and OCR queue in a single round-trip
+        now = datetime.utcnow()
+        (patient_count, document_count, user_count, active_sessions,
+         recent_uploads, pending_ocr) = db.session.query(
+            _count_subquery(Patient),
+            _count_subquery(PatientDocument),
+            _count_subquery(User),
+            _count_subquery(UserSession, UserSession.expires_at > now),
+            _count_subquery(PatientDocument,
+                            PatientDocument.uploaded_at > now - timedelta(hours=24)),
+            _count_subquery(PatientDocument, PatientDocument.ocr_processed == False)
+        ).one()
         
         # Storage usage
         storage_mgr = PatientStorageManager()
         total_storage = calculate_total_storage()
         
-        # Recent activity
-        recent_uploads = PatientDocument.query.filter(
-            PatientDocument.uploaded_at > datetime.utcnow() - timedelta(hours=24)
-        ).count()
-        
-        # OCR queue
-        pending_ocr = PatientDocument.query.filter(
-            PatientDocument.ocr_processed == False
-        ).count()
-        
         return {
             'database': {
                 'size_mb': round(db_size_mb, 2),
@@ -157,8 +248,21 @@ def get_application_metrics() -> Dict[str, Any]:
         return {}
 
 
+def _count_subquery(model, *criteria):
+    """Build a scalar COUNT(*) subquery for model filtered by criteria"""
+    stmt = select(func.count()).select_from(model)
+    if criteria:
+        stmt = stmt.where(*criteria)
+    return stmt.scalar_subquery()
+
+
 def get_security_status() -> Dict[str, Any]:
     """Get security-related status"""
+    return _get_cached(_security_cache, _collect_security_status)
+
+
+def _collect_security_status() -> Dict[str, Any]:
+    """Collect security-related status"""
     try:
         # Failed login attempts in last hour
         from app.auth.models import User
@@ -169,9 +273,9 @@ def get_security_status() -> Dict[str, Any]:
         # Locked accounts
         locked_accounts = User.query.filter(User.is_locked == True).count()
         
-        # Audit log integrity
-        audit_logger = get_audit_logger()
-        integrity_issues = len(audit_logger.verify_integrity())
+        # Audit log integrity (latest background verification)
+        integrity_issues = _audit_integrity['issues_count']
+        last_verified = _audit_integrity['last_verified']
         
         # Physical security (GPIO tamper detection)
         tamper_detected = check_tamper_status()
@@ -189,8 +293,9 @@ def get_security_status() -> Dict[str, Any]:
                 'locked_accounts': locked_accounts
             },
             'audit': {
-                'integrity_ok': integrity_issues == 0,
-                'issues_count': integrity_issues
+                'integrity_ok': integrity_issues == 0 if last_verified else None,
+                'issues_count': integrity_issues,
+                'last_verified': last_verified.isoformat() if last_verified else None
             },
             'physical': {
                 'tamper_detected': tamper_detected,
@@ -198,7 +303,7 @@ def get_security_status() -> Dict[str, Any]:
             },
             'encryption': {
                 'enabled': encryption_enabled,
-                'algorithm': 'AES-256-GCM'
+                'algorithm': ALGORITHM_NAMES[DEFAULT_FILE_ALGORITHM]
             },
             'backup': {
                 'last_backup': last_backup.isoformat() if last_backup else None,
@@ -212,7 +317,12 @@ def get_security_status() -> Dict[str, Any]:
 
 
 def check_sd_card_health() -> Dict[str, Any]:
-    """Check SD card health indicators"""
+    """Get latest SD card health indicators from the background sampler"""
+    return dict(_sd_health)
+
+
+def _read_sd_card_health() -> Dict[str, Any]:
+    """Read SD card health indicators via tune2fs"""
     try:
         # Get SD card device
         sd_device = '/dev/mmcblk0'  # Pi SD card device
@@ -242,16 +352,76 @@ def check_sd_card_health() -> Dict[str, Any]:
         return {'healthy': True, 'lifetime_writes_gb': 0, 'wear_level': 'unknown'}
 
 
+def _cpu_sampler():
+    """Sample CPU usage over each CPU_SAMPLE_INTERVAL until stopped"""
+    # First call only primes psutil's counters
+    psutil.cpu_percent(interval=None)
+    while not _sampler_stop.wait(CPU_SAMPLE_INTERVAL):
+        _latest_cpu['percent'] = psutil.cpu_percent(interval=None)
+
+
+def _sd_health_sampler():
+    """Refresh SD card health every SD_HEALTH_INTERVAL until stopped"""
+    while not _sampler_stop.is_set():
+        _sd_health.update(_read_sd_card_health())
+        _sampler_stop.wait(SD_HEALTH_INTERVAL)
+
+
+def _audit_integrity_sampler(app):
+    """Verify newly appended audit entries every AUDIT_VERIFY_INTERVAL until stopped"""
+    while not _sampler_stop.is_set():
+        with app.app_context():
+            try:
+                issues = get_audit_logger().verify_new_entries()
+                _audit_integrity['issues_count'] += len(issues)
+                _audit_integrity['last_verified'] = datetime.utcnow()
+            except Exception as e:
+                logger.error(f"Audit log verification failed: {str(e)}")
+        _sampler_stop.wait(AUDIT_VERIFY_INTERVAL)
+
+
+def _metrics_publisher(app):
+    """Publish a status snapshot every METRICS_PUBLISH_INTERVAL until stopped"""
+    while not _sampler_stop.is_set():
+        with app.app_context():
+            try:
+                publish_metrics()
+            except Exception as e:
+                logger.error(f"Failed to publish metrics: {str(e)}")
+        _sampler_stop.wait(METRICS_PUBLISH_INTERVAL)
+
+
+def start_metrics_samplers(app):
+    """Start background metric samplers (call once at app startup)"""
+    if _sampler_threads:
+        return
+    
+    _sampler_stop.clear()
+    samplers = (
+        (_cpu_sampler, ()),
+        (_sd_health_sampler, ()),
+        (_audit_integrity_sampler, (app,)),
+        (_metrics_publisher, (app,))
+    )
+    for target, args in samplers:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        _sampler_threads.append(thread)
+
+
+def stop_metrics_samplers():
+    """Signal background metric samplers to exit"""
+    _sampler_stop.set()
+    for thread in _sampler_threads:
+        thread.join(timeout=5)
+    _sampler_threads.clear()
+
+
 def is_cpu_throttled() -> bool:
-    """Check if CPU is being throttled"""
+    """Check if CPU is being throttled (read from firmware sysfs, no vcgencmd fork)"""
     try:
-        result = subprocess.run(
-            ['vcgencmd', 'get_throttled'],
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            throttled = int(result.stdout.split('=')[1], 16)
+        with open(THROTTLED_PATH, 'r') as f:
+            throttled = int(f.read().strip(), 16)
             return throttled != 0
     except:
         pass
@@ -270,15 +440,15 @@ def get_uptime_hours() -> float:
 
 def calculate_total_storage() -> int:
     """Calculate total storage used by patient data"""
-    patient_folder = Path(current_app.config['PATIENT_DATA_FOLDER'])
-    total_size = 0
-    
-    if patient_folder.exists():
-        for path in patient_folder.rglob('*'):
-            if path.is_file():
-                total_size += path.stat().st_size
-    
-    return total_size
+    return _get_cached(_storage_cache, _collect_total_storage, ttl=_STORAGE_CACHE_TTL)
+
+
+def _collect_total_storage() -> int:
+    """Walk the patient data folder and sum file sizes"""
+    patient_folder = current_app.config['PATIENT_DATA_FOLDER']
+    if not os.path.isdir(patient_folder):
+        return 0
+    return scan_tree(patient_folder)[0]
 
 
 def check_tamper_status() -> bool:
@@ -294,22 +464,18 @@ def check_tamper_status() -> bool:
 
 def get_last_backup_time() -> Optional[datetime]:
     """Get timestamp of last successful backup"""
-    backup_folder = Path(current_app.config['BACKUP_FOLDER'])
-    if not backup_folder.exists():
+    backup_folder = current_app.config['BACKUP_FOLDER']
+    try:
+        entries = os.listdir(backup_folder)
+    except OSError:
         return None
     
-    # Find most recent backup file
-    backup_files = list(backup_folder.glob('psyward_backup_*.enc'))
-    if not backup_files:
+    # Filenames encode the timestamp, so lexical max is the latest (no stat calls)
+    timestamps = [m.group(1) for m in map(_BACKUP_NAME_RE.match, entries) if m]
+    if not timestamps:
         return None
     
-    # Extract timestamp from filename
-    latest_backup = max(backup_files, key=lambda p: p.stat().st_mtime)
-    try:
-        timestamp_str = latest_backup.stem.replace('psyward_backup_', '')
-        return datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-    except:
-        return None
+    return datetime.strptime(max(timestamps), '%Y%m%d_%H%M%S')
 
 
 def get_system_statistics() -> Dict[str, Any]:
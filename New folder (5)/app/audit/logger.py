@@ -1,14 +1,31 @@
 """HIPAA-compliant audit logging with tamper protection"""
 import os
 import json
+import fcntl
+import atexit
+import mmap
 import hashlib
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from pathlib import Path
-import blake2b
+import orjson
 from flask import current_app, request
 from app import db, logger
 
+try:
+    import blake3
+    BLAKE3_AVAILABLE = True
+except ImportError:
+    BLAKE3_AVAILABLE = False
+
+
+# Log format 2.0 hashes fixed-order field bytes instead of sorted JSON.
+# Logs created as 1.0 keep the legacy scheme so their chains still verify.
+LOG_FORMAT_VERSION = '2.0'
+LEGACY_HASH_SCHEME = 'legacy'
+_FIELD_SEP = b'\x1f'
+
 
 class TamperProofLog:
     """Append-only audit log with cryptographic integrity"""
@@ -16,7 +33,51 @@ class TamperProofLog:
     def __init__(self, log_path: str):
         self.log_path = Path(log_path)
         self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self._hash_scheme = self._detect_hash_scheme()
         self._ensure_log_file()
+        
+        # Cache chain tail so append() doesn't re-read the file each time;
+        # _tail_size tells append() when another process has written since
+        self._lock = threading.Lock()
+        self._last_hash, self._next_id = self._read_tail()
+        self._fd = self._open_fd()
+        self._tail_size = os.fstat(self._fd).st_size
+        atexit.register(self.close)
+        
+        # Highest entry_id checked by verify_new_entries()
+        self._verified_id = -1
+    
+    def _open_fd(self) -> int:
+        """Open long-lived O_APPEND descriptor (kernel keeps appends atomic)"""
+        return os.open(
+            str(self.log_path),
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC,
+            0o600
+        )
+    
+    def close(self):
+        """Close the log file descriptor"""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+    
+    def _detect_hash_scheme(self) -> str:
+        """Determine hash scheme from the genesis entry (or pick one for a new log)"""
+        if self.log_path.exists() and self.log_path.stat().st_size > 0:
+            with open(self.log_path, 'rb') as f:
+                genesis = orjson.loads(f.readline())
+            
+            version = genesis.get('data', {}).get('version', '1.0')
+            if version == '1.0':
+                return LEGACY_HASH_SCHEME
+            
+            scheme = genesis['data'].get('hash_algorithm', 'blake2b')
+            if scheme == 'blake3' and not BLAKE3_AVAILABLE:
+                raise RuntimeError(f"Audit log {self.log_path} requires the blake3 package")
+            return scheme
+        
+        return 'blake3' if BLAKE3_AVAILABLE else 'blake2b'
     
     def _ensure_log_file(self):
         """Initialize log file if not exists"""
@@ -26,14 +87,16 @@ class TamperProofLog:
                 'entry_id': 0,
                 'timestamp': datetime.utcnow().isoformat(),
                 'event': 'LOG_INITIALIZED',
-                'data': {'version': '1.0'},
+                'data': {
+                    'version': LOG_FORMAT_VERSION,
+                    'hash_algorithm': self._hash_scheme
+                },
                 'previous_hash': '0' * 64
             }
             genesis['hash'] = self._calculate_hash(genesis)
             
-            with open(self.log_path, 'w') as f:
-                json.dump(genesis, f)
-                f.write('\n')
+            with open(self.log_path, 'wb') as f:
+                f.write(orjson.dumps(genesis) + b'\n')
             
             # Set file as append-only (on Linux)
             try:
@@ -43,33 +106,87 @@ class TamperProofLog:
     
     def append(self, event: str, user_id: Optional[int], data: Dict[str, Any]) -> str:
         """Append new entry to audit log"""
-        # Get last entry hash
-        previous_hash = self._get_last_hash()
-        
-        # Create new entry
-        entry = {
-            'entry_id': self._get_next_id(),
-            'timestamp': datetime.utcnow().isoformat(),
-            'event': event,
-            'user_id': user_id,
-            'ip_address': request.remote_addr if request else None,
-            'user_agent': request.user_agent.string if request else None,
-            'data': data,
-            'previous_hash': previous_hash
-        }
-        
-        # Calculate hash including previous hash
-        entry['hash'] = self._calculate_hash(entry)
-        
-        # Append to log
-        with open(self.log_path, 'a') as f:
-            json.dump(entry, f, separators=(',', ':'))
-            f.write('\n')
+        with self._lock:
+            # entry_id and previous_hash are filled in under the file lock
+            entry = {
+                'entry_id': None,
+                'timestamp': datetime.utcnow().isoformat(),
+                'event': event,
+                'user_id': user_id,
+                'ip_address': request.remote_addr if request else None,
+                'user_agent': request.user_agent.string if request else None,
+                'data': data,
+                'previous_hash': None
+            }
+            
+            try:
+                self._write_entry(entry)
+            except (IOError, OSError):
+                # Handle went stale (rotation, remount) - rescan and retry once
+                self._reopen()
+                self._write_entry(entry)
         
         return entry['hash']
     
+    def _write_entry(self, entry: Dict[str, Any]):
+        """Chain entry to the current tail and append it under an exclusive file lock"""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Another process (e.g. a CLI import) appended since our last write
+            size = os.fstat(self._fd).st_size
+            if size != self._tail_size:
+                self._last_hash, self._next_id = self._read_tail()
+            
+            # Calculate hash including previous hash
+            entry['entry_id'] = self._next_id
+            entry['previous_hash'] = self._last_hash
+            entry['hash'] = self._calculate_hash(entry)
+            
+            # Append to log (single write on the O_APPEND fd)
+            line = orjson.dumps(entry) + b'\n'
+            os.write(self._fd, line)
+            
+            self._tail_size = size + len(line)
+            self._last_hash = entry['hash']
+            self._next_id += 1
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+    
+    def _reopen(self):
+        """Reopen log file and refresh cached tail state from disk"""
+        try:
+            if self._fd is not None:
+                os.close(self._fd)
+        except (IOError, OSError):
+            pass
+        self._ensure_log_file()
+        self._last_hash, self._next_id = self._read_tail()
+        self._fd = self._open_fd()
+        self._tail_size = os.fstat(self._fd).st_size
+    
     def _calculate_hash(self, entry: Dict[str, Any]) -> str:
-        """Calculate BLAKE2b hash of entry"""
+        """Calculate BLAKE3 (or BLAKE2b) hash of entry"""
+        if self._hash_scheme == LEGACY_HASH_SCHEME:
+            return self._calculate_legacy_hash(entry)
+        
+        # Fixed-order field bytes; only the nested data needs canonical JSON
+        user_id = entry.get('user_id')
+        content = _FIELD_SEP.join([
+            str(entry['entry_id']).encode(),
+            entry['timestamp'].encode(),
+            entry['event'].encode(),
+            b'' if user_id is None else str(user_id).encode(),
+            orjson.dumps(entry.get('data', {}), option=orjson.OPT_SORT_KEYS),
+            entry['previous_hash'].encode()
+        ])
+        
+        if self._hash_scheme == 'blake3':
+            return blake3.blake3(content).hexdigest()
+        return hashlib.blake2b(content, digest_size=32).hexdigest()
+    
+    @staticmethod
+    def _calculate_legacy_hash(entry: Dict[str, Any]) -> str:
+        """Calculate BLAKE2b hash of entry (log format 1.0)"""
         # Create consistent string representation
         content = json.dumps({
             'entry_id': entry['entry_id'],
@@ -85,8 +202,8 @@ class TamperProofLog:
         h.update(content.encode('utf-8'))
         return h.hexdigest()
     
-    def _get_last_hash(self) -> str:
-        """Get hash of last log entry"""
+    def _read_tail(self) -> Tuple[str, int]:
+        """Get hash and next entry ID from the last log entry"""
         try:
             with open(self.log_path, 'rb') as f:
                 # Seek to end and read backwards to find last line
@@ -94,59 +211,63 @@ class TamperProofLog:
                 file_size = f.tell()
                 
                 if file_size == 0:
-                    return '0' * 64
+                    return '0' * 64, 1
                 
-                # Read last ~1KB to find last line
-                read_size = min(file_size, 1024)
-                f.seek(file_size - read_size)
-                lines = f.read().decode('utf-8').strip().split('\n')
+                # Read last ~1KB to find last line, widening if the entry is longer
+                read_size = 1024
+                while True:
+                    read_size = min(file_size, read_size)
+                    f.seek(file_size - read_size)
+                    tail = f.read().rstrip(b'\n')
+                    if b'\n' in tail or read_size == file_size:
+                        break
+                    read_size *= 4
                 
-                if lines:
-                    last_entry = json.loads(lines[-1])
-                    return last_entry['hash']
+                last_line = tail.rsplit(b'\n', 1)[-1]
+                if last_line:
+                    last_entry = orjson.loads(last_line)
+                    return last_entry['hash'], last_entry['entry_id'] + 1
         except Exception as e:
-            logger.error(f"Failed to get last hash: {str(e)}")
-        
-        return '0' * 64
-    
-    def _get_next_id(self) -> int:
-        """Get next entry ID"""
-        try:
-            with open(self.log_path, 'rb') as f:
-                f.seek(0, 2)
-                file_size = f.tell()
-                
-                if file_size == 0:
-                    return 1
-                
-                # Read last line
-                read_size = min(file_size, 1024)
-                f.seek(file_size - read_size)
-                lines = f.read().decode('utf-8').strip().split('\n')
-                
-                if lines:
-                    last_entry = json.loads(lines[-1])
-                    return last_entry['entry_id'] + 1
-        except:
-            pass
+            logger.error(f"Failed to read log tail: {str(e)}")
         
-        return 1
+        return '0' * 64, 1
     
     def verify_integrity(self, start_id: int = 0, end_id: Optional[int] = None) -> List[Dict[str, Any]]:
         """Verify log integrity by checking hash chain"""
         issues = []
         previous_hash = '0' * 64
         
-        with open(self.log_path, 'r') as f:
-            for line_num, line in enumerate(f):
-                if not line.strip():
-                    continue
+        with open(self.log_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return issues
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # Jump to the entry preceding start_id; it anchors the chain
+                offset = self._find_entry_offset(mm, start_id - 1) if start_id > 0 else 0
+                mm.seek(offset)
                 
-                try:
-                    entry = json.loads(line)
+                # Bad lines are located by byte offset; line numbers only when
+                # scanning from the top (counting to a seek point reads it all)
+                line_num = 0 if offset == 0 else None
+                for line in iter(mm.readline, b''):
+                    line_offset, offset = offset, offset + len(line)
+                    if line_num is not None:
+                        line_num += 1
+                    if not line.strip():
+                        continue
+                    
+                    try:
+                        entry = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        issue = {'offset': line_offset, 'issue': 'invalid_json'}
+                        if line_num is not None:
+                            issue['line'] = line_num
+                        issues.append(issue)
+                        continue
                     
                     # Check if within range
                     if entry['entry_id'] < start_id:
+                        previous_hash = entry['hash']
                         continue
                     if end_id and entry['entry_id'] > end_id:
                         break
@@ -171,14 +292,44 @@ class TamperProofLog:
                         })
                     
                     previous_hash = entry['hash']
-                    
-                except json.JSONDecodeError:
-                    issues.append({
-                        'line': line_num + 1,
-                        'issue': 'invalid_json'
-                    })
         
         return issues
+    
+    def verify_new_entries(self) -> List[Dict[str, Any]]:
+        """Verify only entries appended since the previous call"""
+        # The on-disk tail, not the cached one - other processes append too
+        end_id = self._read_tail()[1] - 1
+        if end_id <= self._verified_id:
+            return []
+        
+        issues = self.verify_integrity(start_id=self._verified_id + 1, end_id=end_id)
+        self._verified_id = end_id
+        return issues
+    
+    @staticmethod
+    def _find_entry_offset(mm: mmap.mmap, entry_id: int) -> int:
+        """Binary search for the offset of the first line with entry_id >= given ID"""
+        lo, hi = 0, len(mm)
+        
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line_start = mm.rfind(b'\n', 0, mid) + 1
+            line_end = mm.find(b'\n', line_start)
+            if line_end == -1:
+                line_end = len(mm)
+            
+            try:
+                current_id = orjson.loads(mm[line_start:line_end])['entry_id']
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                # Can't trust ordering around a damaged line - scan from the top
+                return 0
+            
+            if current_id < entry_id:
+                lo = line_end + 1
+            else:
+                hi = line_start
+        
+        return min(lo, len(mm))
 
 
 # Global audit logger instance
@@ -2,9 +2,9 @@
 from datetime import datetime
 from typing import Optional, List
 from flask_login import UserMixin
-from sqlalchemy import func
+from sqlalchemy import Index, func, update, case, event
 from app import db
-from app.auth.security import verify_password, hash_password
+from app.auth.security import verify_password, hash_password, SessionManager, _forget_session
 
 
 class Role(db.Model):
@@ -84,8 +84,10 @@ class User(UserMixin, db.Model):
     sessions = db.relationship('UserSession', backref='user', cascade='all, delete-orphan')
     
     def set_password(self, password: str):
-        """Hash and set user password"""
+        """Hash and set user password (ends the user's existing sessions)"""
         self.password_hash = hash_password(password)
+        if self.id is not None:
+            SessionManager.end_user_sessions(self.id)
     
     def check_password(self, password: str) -> bool:
         """Verify password against hash"""
@@ -93,26 +95,40 @@ class User(UserMixin, db.Model):
     
     def has_permission(self, permission: str) -> bool:
         """Check if user has specific permission"""
-        if not self.role:
-            return False
-        if '*' in self.role.permissions:
-            return True
-        return permission in self.role.permissions
+        permissions = self._permission_set()
+        return '*' in permissions or permission in permissions
+    
+    def _permission_set(self) -> frozenset:
+        """Get role permissions as a frozenset, memoized per role on this instance"""
+        role = self.role
+        cached = getattr(self, '_permission_cache', None)
+        if cached is None or cached[0] is not role:
+            permissions = frozenset(role.permissions or ()) if role else frozenset()
+            cached = (role, permissions)
+            self._permission_cache = cached
+        return cached[1]
     
     def increment_failed_login(self):
-        """Track failed login attempts"""
-        self.failed_login_attempts += 1
-        self.last_failed_login = datetime.utcnow()
-        if self.failed_login_attempts >= 5:
-            self.is_locked = True
-        db.session.commit()
+        """Track failed login attempts (committed at end of request)"""
+        # Single atomic UPDATE; concurrent failures can't lose increments
+        attempts = User.failed_login_attempts + 1
+        db.session.execute(
+            update(User)
+            .where(User.id == self.id)
+            .values(
+                failed_login_attempts=attempts,
+                last_failed_login=datetime.utcnow(),
+                is_locked=case((attempts >= 5, True), else_=User.is_locked)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.expire(self, ['failed_login_attempts', 'last_failed_login', 'is_locked'])
     
     def reset_failed_login(self):
-        """Reset failed login counter on successful login"""
+        """Reset failed login counter on successful login (committed at end of request)"""
         self.failed_login_attempts = 0
         self.last_failed_login = None
         self.last_login = datetime.utcnow()
-        db.session.commit()
 
 
 class UserSession(db.Model):
@@ -127,8 +143,19 @@ class UserSession(db.Model):
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
     
+    # Indexes (active-session counts and expiry cleanup filter on expires_at)
+    __table_args__ = (
+        Index('idx_session_expires', 'expires_at'),
+    )
+    
     @classmethod
     def cleanup_expired(cls):
         """Remove expired sessions"""
         cls.query.filter(cls.expires_at < datetime.utcnow()).delete()
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+
+@event.listens_for(UserSession, 'after_delete')
+def _uncache_deleted_session(mapper, connection, target: UserSession):
+    """Sessions deleted through the ORM (incl. user cascade) stop validating at once"""
+    _forget_session(target.id)
\ No newline at end of file
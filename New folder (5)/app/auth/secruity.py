@@ -1,17 +1,17 @@
 """Security utilities for authentication and encryption"""
 import os
 import secrets
-from typing import Tuple, Optional
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple, Optional, Dict
 from datetime import datetime, timedelta
-import argon2
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-import pyotp
 from flask import current_app
 from config.constraints import PI_ZERO_LIMITS
 
+# argon2, cryptography.hazmat and pyotp are imported where used to keep boot RSS low
+
 
 # Argon2 parameters optimized for Pi Zero
 ARGON2_TIME_COST = 4  # iterations
@@ -19,25 +19,44 @@ ARGON2_MEMORY_COST = 1024  # 1MB - safe for 512MB RAM
 ARGON2_PARALLELISM = 1  # Single core
 ARGON2_HASH_LEN = 32
 
+# Expired sessions are purged in the background, not on the request path
+SESSION_CLEANUP_INTERVAL = 60  # seconds
+_cleanup_stop = threading.Event()
+_cleanup_thread: Optional[threading.Thread] = None
 
-def hash_password(password: str) -> str:
-    """Hash password using Argon2 with Pi Zero optimized parameters"""
-    ph = argon2.PasswordHasher(
+# Validated sessions are cached in-process so requests skip the SELECT;
+# last_activity is batched and written by the cleanup worker
+SESSION_CACHE_TTL = 60  # seconds before a cached session is re-read from the DB
+SESSION_CACHE_MAX = 10000
+_session_cache: 'OrderedDict[str, Tuple[int, datetime, str, float]]' = OrderedDict()
+_pending_activity: Dict[str, datetime] = {}
+_session_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_password_hasher():
+    """Shared hasher - built on first use, not on every login"""
+    import argon2
+    return argon2.PasswordHasher(
         time_cost=ARGON2_TIME_COST,
         memory_cost=ARGON2_MEMORY_COST,
         parallelism=ARGON2_PARALLELISM,
         hash_len=ARGON2_HASH_LEN
     )
-    return ph.hash(password)
+
+
+def hash_password(password: str) -> str:
+    """Hash password using Argon2 with Pi Zero optimized parameters"""
+    return _get_password_hasher().hash(password)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    """Verify password against Argon2 hash"""
-    ph = argon2.PasswordHasher()
+    """Verify password against Argon2 hash (parameters are read from the hash)"""
+    from argon2.exceptions import VerifyMismatchError
     try:
-        ph.verify(password_hash, password)
+        _get_password_hasher().verify(password_hash, password)
         return True
-    except argon2.exceptions.VerifyMismatchError:
+    except VerifyMismatchError:
         return False
 
 
@@ -46,8 +65,14 @@ def generate_file_key() -> bytes:
     return secrets.token_bytes(32)
 
 
+# PBKDF2 is deliberately slow (~100s of ms on the Pi) and deterministic, so
+# derived keys are memoised in process memory (never persisted)
+@lru_cache(maxsize=1024)
 def derive_key_from_master(master_key: bytes, salt: bytes, info: bytes = b'file-encryption') -> bytes:
     """Derive a file encryption key from master key"""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
@@ -57,53 +82,244 @@ def derive_key_from_master(master_key: bytes, salt: bytes, info: bytes = b'file-
     return kdf.derive(master_key + info)
 
 
+# Encrypted file layout:
+#   MAGIC (4) || algorithm (1) || nonce prefix (8) || sealed chunks...
+# Chunk i is sealed with nonce = prefix || i (4 bytes, big-endian), so no
+# nonce is ever reused under a key. Its associated data marks whether it
+# is the final chunk, which makes reordering and truncation detectable.
+# Files without MAGIC use the legacy layout (AES-GCM, one nonce for all
+# chunks) and can still be decrypted.
+FILE_MAGIC = b'PSYE'
+ALG_AES_256_GCM = 1
+ALG_CHACHA20_POLY1305 = 2
+ALGORITHM_NAMES = {
+    ALG_AES_256_GCM: 'AES-256-GCM',
+    ALG_CHACHA20_POLY1305: 'ChaCha20-Poly1305'
+}
+NONCE_PREFIX_SIZE = 8
+AEAD_TAG_SIZE = 16
+LEGACY_NONCE_SIZE = 12
+_HEADER_SIZE = len(FILE_MAGIC) + 1 + NONCE_PREFIX_SIZE
+_CHUNK_AAD = b'chunk'
+_FINAL_CHUNK_AAD = b'final'
+
+
+def _has_aes_hw() -> bool:
+    """Check /proc/cpuinfo for AES instructions (x86 'aes' flag, ARM 'aes' feature)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key.strip().lower() in ('flags', 'features'):
+                    return 'aes' in value.split()
+    except OSError:
+        pass
+    # Unknown platform - keep AES-GCM
+    return True
+
+
+# Pi Zero (ARMv6) has no AES instructions; ChaCha20 is ~3x faster in software
+DEFAULT_FILE_ALGORITHM = ALG_AES_256_GCM if _has_aes_hw() else ALG_CHACHA20_POLY1305
+
+
 class FileEncryption:
-    """AES-GCM file encryption optimized for low memory"""
+    """Chunked AEAD file encryption optimized for low memory"""
+    
+    def __init__(self, key: bytes, algorithm_id: Optional[int] = None):
+        self._key = key
+        self._ciphers = {}
+        self.algorithm_id = algorithm_id or DEFAULT_FILE_ALGORITHM
+        self.aead = self._get_cipher(self.algorithm_id)
+    
+    def _get_cipher(self, algorithm_id: int):
+        """Get (cached) AEAD cipher object for algorithm id"""
+        cipher = self._ciphers.get(algorithm_id)
+        if cipher is None:
+            if algorithm_id == ALG_AES_256_GCM:
+                from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+                cipher = AESGCM(self._key)
+            elif algorithm_id == ALG_CHACHA20_POLY1305:
+                from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+                cipher = ChaCha20Poly1305(self._key)
+            else:
+                raise ValueError(f"Unsupported encryption algorithm id {algorithm_id}")
+            self._ciphers[algorithm_id] = cipher
+        return cipher
+    
+    @staticmethod
+    def _chunk_nonce(nonce_prefix: bytes, counter: int) -> bytes:
+        """Build the 96-bit nonce for chunk number counter"""
+        return nonce_prefix + counter.to_bytes(4, 'big')
     
-    def __init__(self, key: bytes):
-        self.aesgcm = AESGCM(key)
+    def _new_header(self) -> Tuple[bytes, bytes]:
+        """Create header and nonce prefix for a new encrypted blob"""
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        return FILE_MAGIC + bytes([self.algorithm_id]) + nonce_prefix, nonce_prefix
+    
+    def _parse_header(self, header: bytes):
+        """Get (cipher, nonce prefix) from header, or None for legacy layout"""
+        if len(header) < _HEADER_SIZE or not header.startswith(FILE_MAGIC):
+            return None
+        cipher = self._get_cipher(header[len(FILE_MAGIC)])
+        return cipher, header[len(FILE_MAGIC) + 1:_HEADER_SIZE]
+    
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        """Encrypt small in-memory payload (e.g. OCR text) as a single final chunk"""
+        header, nonce_prefix = self._new_header()
+        return header + self.aead.encrypt(
+            self._chunk_nonce(nonce_prefix, 0), data, _FINAL_CHUNK_AAD
+        )
+    
+    def decrypt_bytes(self, blob: bytes) -> bytes:
+        """Decrypt payload produced by encrypt_bytes (or legacy nonce || ciphertext)"""
+        parsed = self._parse_header(blob[:_HEADER_SIZE])
+        if parsed is None:
+            cipher = self._get_cipher(ALG_AES_256_GCM)
+            return cipher.decrypt(blob[:LEGACY_NONCE_SIZE], blob[LEGACY_NONCE_SIZE:], None)
+        
+        cipher, nonce_prefix = parsed
+        return cipher.decrypt(
+            self._chunk_nonce(nonce_prefix, 0), blob[_HEADER_SIZE:], _FINAL_CHUNK_AAD
+        )
     
     def encrypt_file(self, file_path: str, output_path: str, 
                      chunk_size: int = PI_ZERO_LIMITS.ENCRYPTION_BUFFER * 1024) -> Tuple[str, bytes]:
-        """Encrypt file in chunks to conserve memory"""
-        nonce = os.urandom(12)  # 96-bit nonce for GCM
+        """Encrypt file in chunks to conserve memory (returns path and nonce prefix)"""
+        header, nonce_prefix = self._new_header()
         
         with open(file_path, 'rb') as infile, open(output_path, 'wb') as outfile:
-            # Write nonce at beginning
-            outfile.write(nonce)
+            # Write header at beginning
+            outfile.write(header)
             
+            # Read one chunk ahead so the last chunk can be flagged as final
+            counter = 0
+            chunk = infile.read(chunk_size)
             while True:
-                chunk = infile.read(chunk_size)
-                if not chunk:
-                    break
+                next_chunk = infile.read(chunk_size)
+                aad = _CHUNK_AAD if next_chunk else _FINAL_CHUNK_AAD
                 
                 # Encrypt chunk
-                ciphertext = self.aesgcm.encrypt(nonce, chunk, None)
+                ciphertext = self.aead.encrypt(
+                    self._chunk_nonce(nonce_prefix, counter), chunk, aad
+                )
                 outfile.write(ciphertext)
+                
+                if not next_chunk:
+                    break
+                chunk = next_chunk
+                counter += 1
         
-        return output_path, nonce
+        return output_path, nonce_prefix
+    
+    def open_writer(self, output_path: str,
+                    chunk_size: int = PI_ZERO_LIMITS.ENCRYPTION_BUFFER * 1024) -> 'EncryptingWriter':
+        """Open file-like sink that encrypts whatever is written to it (same layout as encrypt_file)"""
+        header, nonce_prefix = self._new_header()
+        outfile = open(output_path, 'wb')
+        outfile.write(header)
+        return EncryptingWriter(self, outfile, nonce_prefix, chunk_size)
     
     def decrypt_file(self, file_path: str, output_path: str,
                      chunk_size: int = PI_ZERO_LIMITS.ENCRYPTION_BUFFER * 1024) -> str:
         """Decrypt file in chunks"""
         with open(file_path, 'rb') as infile:
-            # Read nonce
-            nonce = infile.read(12)
+            # Read header
+            parsed = self._parse_header(infile.read(_HEADER_SIZE))
+            if parsed is None:
+                infile.seek(0)
+                return self._decrypt_legacy(infile, output_path, chunk_size)
+            cipher, nonce_prefix = parsed
             
             with open(output_path, 'wb') as outfile:
+                # Read chunk (ciphertext is 16 bytes larger due to tag)
+                counter = 0
+                chunk = infile.read(chunk_size + AEAD_TAG_SIZE)
                 while True:
-                    # Read chunk (ciphertext is 16 bytes larger due to tag)
-                    chunk = infile.read(chunk_size + 16)
-                    if not chunk:
-                        break
+                    next_chunk = infile.read(chunk_size + AEAD_TAG_SIZE)
+                    aad = _CHUNK_AAD if next_chunk else _FINAL_CHUNK_AAD
                     
-                    # Decrypt chunk
-                    plaintext = self.aesgcm.decrypt(nonce, chunk, None)
+                    # Decrypt chunk (raises InvalidTag on tamper/truncation)
+                    plaintext = cipher.decrypt(
+                        self._chunk_nonce(nonce_prefix, counter), chunk, aad
+                    )
                     outfile.write(plaintext)
+                    
+                    if not next_chunk:
+                        break
+                    chunk = next_chunk
+                    counter += 1
+        
+        return output_path
+    
+    def _decrypt_legacy(self, infile, output_path: str, chunk_size: int) -> str:
+        """Decrypt file written in the legacy single-nonce AES-GCM layout"""
+        cipher = self._get_cipher(ALG_AES_256_GCM)
+        nonce = infile.read(LEGACY_NONCE_SIZE)
+        
+        with open(output_path, 'wb') as outfile:
+            while True:
+                chunk = infile.read(chunk_size + AEAD_TAG_SIZE)
+                if not chunk:
+                    break
+                
+                plaintext = cipher.decrypt(nonce, chunk, None)
+                outfile.write(plaintext)
         
         return output_path
 
 
+class EncryptingWriter:
+    """Write-only stream that emits fixed-size AEAD chunks as data arrives"""
+    
+    def __init__(self, encryption: FileEncryption, outfile, nonce_prefix: bytes,
+                 chunk_size: int):
+        self._encryption = encryption
+        self._outfile = outfile
+        self._nonce_prefix = nonce_prefix
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._counter = 0
+        self.closed = False
+    
+    def write(self, data) -> int:
+        """Buffer data, encrypting every full chunk except the newest"""
+        self._buffer += data
+        # Hold back the last chunk until close() so it can be flagged final
+        while len(self._buffer) > self._chunk_size:
+            self._emit(bytes(self._buffer[:self._chunk_size]), _CHUNK_AAD)
+            del self._buffer[:self._chunk_size]
+        return len(data)
+    
+    def _emit(self, chunk: bytes, aad: bytes):
+        """Encrypt and write one chunk"""
+        nonce = self._encryption._chunk_nonce(self._nonce_prefix, self._counter)
+        self._outfile.write(self._encryption.aead.encrypt(nonce, chunk, aad))
+        self._counter += 1
+    
+    def close(self):
+        """Write the final chunk and close the output file"""
+        if self.closed:
+            return
+        try:
+            self._emit(bytes(self._buffer), _FINAL_CHUNK_AAD)
+        finally:
+            self._buffer.clear()
+            self._outfile.close()
+            self.closed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # No final chunk - a partial file fails decryption instead of
+            # looking like a complete (truncated) one
+            self._outfile.close()
+            self.closed = True
+
+
 class SessionManager:
     """Secure session management with timeout"""
     
@@ -125,9 +341,11 @@ class SessionManager:
             expires_at=expires_at
         )
         
+        # Flush only - the request's after_request hook commits it together
+        # with the rest of the login writes (one fsync instead of several)
         from app import db
         db.session.add(session)
-        db.session.commit()
+        db.session.flush()
         
         return session_id
     
@@ -136,47 +354,160 @@ class SessionManager:
         """Validate session and return user_id if valid"""
         from app.auth.models import UserSession
         
-        session = UserSession.query.get(session_id)
-        if not session:
-            return None
+        now = datetime.utcnow()
+        with _session_cache_lock:
+            cached = _session_cache.get(session_id)
+            if cached is not None and time.monotonic() - cached[3] < SESSION_CACHE_TTL:
+                _session_cache.move_to_end(session_id)
+            else:
+                cached = None
+        
+        if cached is None:
+            session = UserSession.query.get(session_id)
+            if not session:
+                _forget_session(session_id)
+                return None
+            cached = (session.user_id, session.expires_at, session.ip_address, time.monotonic())
+            with _session_cache_lock:
+                _session_cache[session_id] = cached
+                if len(_session_cache) > SESSION_CACHE_MAX:
+                    _session_cache.popitem(last=False)
+        
+        user_id, expires_at, session_ip, _ = cached
         
         # Check expiration
-        if session.expires_at < datetime.utcnow():
+        if expires_at < now:
             from app import db
-            db.session.delete(session)
+            _forget_session(session_id)
+            UserSession.query.filter_by(id=session_id).delete()
             db.session.commit()
             return None
         
         # Validate IP (optional strict mode)
-        if session.ip_address != ip_address:
+        if session_ip != ip_address:
             # Log potential session hijacking
             from app.audit.logger import log_security_event
             log_security_event('SESSION_IP_MISMATCH', ip_address, {
                 'session_id': session_id,
-                'expected_ip': session.ip_address
+                'expected_ip': session_ip
             })
         
-        # Update last activity
-        session.last_activity = datetime.utcnow()
+        # Update last activity (written in batch by flush_session_activity)
+        with _session_cache_lock:
+            _pending_activity[session_id] = now
+        
+        return user_id
+    
+    @staticmethod
+    def end_session(session_id: str):
+        """End a session (logout) - deleted and dropped from the validation cache"""
+        from app.auth.models import UserSession
         from app import db
+        
+        UserSession.query.filter_by(id=session_id).delete()
         db.session.commit()
+        # After the commit, so a concurrent validate can't re-cache the old row
+        _forget_session(session_id)
+    
+    @staticmethod
+    def end_user_sessions(user_id: int) -> int:
+        """End every session of a user (admin revoke, password change)"""
+        from app.auth.models import UserSession
+        from app import db
         
-        return session.user_id
+        count = UserSession.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+        _forget_user_sessions(user_id)
+        return count
+
+
+def _forget_session(session_id: str):
+    """Drop session from the validation cache and pending activity"""
+    with _session_cache_lock:
+        _session_cache.pop(session_id, None)
+        _pending_activity.pop(session_id, None)
+
+
+def _forget_user_sessions(user_id: int):
+    """Drop every cached session belonging to user_id"""
+    with _session_cache_lock:
+        session_ids = [sid for sid, cached in _session_cache.items() if cached[0] == user_id]
+        for session_id in session_ids:
+            del _session_cache[session_id]
+            _pending_activity.pop(session_id, None)
+
+
+def flush_session_activity():
+    """Write batched last_activity timestamps in a single executemany UPDATE"""
+    from sqlalchemy import update, bindparam
+    from app.auth.models import UserSession
+    from app import db
+    
+    with _session_cache_lock:
+        if not _pending_activity:
+            return
+        pending = [{'sid': sid, 'ts': ts} for sid, ts in _pending_activity.items()]
+        _pending_activity.clear()
+    
+    table = UserSession.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('sid')).values(last_activity=bindparam('ts')),
+        pending
+    )
+    db.session.commit()
+
+
+def _session_cleanup_worker(app):
+    """Purge expired sessions every SESSION_CLEANUP_INTERVAL until stopped"""
+    from app.auth.models import UserSession
+    from app import db, logger
+    
+    while not _cleanup_stop.wait(SESSION_CLEANUP_INTERVAL):
+        with app.app_context():
+            try:
+                flush_session_activity()
+                UserSession.cleanup_expired()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Session cleanup failed: {str(e)}")
+
+
+def start_session_cleanup(app):
+    """Start background expired-session cleanup (call once at app startup)"""
+    global _cleanup_thread
+    if _cleanup_thread is not None:
+        return
+    
+    _cleanup_stop.clear()
+    _cleanup_thread = threading.Thread(target=_session_cleanup_worker, args=(app,), daemon=True)
+    _cleanup_thread.start()
+
+
+def stop_session_cleanup():
+    """Signal background session cleanup to exit"""
+    global _cleanup_thread
+    _cleanup_stop.set()
+    if _cleanup_thread is not None:
+        _cleanup_thread.join(timeout=5)
+        _cleanup_thread = None
 
 
 def generate_totp_secret() -> str:
     """Generate TOTP secret for 2FA"""
+    import pyotp
     return pyotp.random_base32()
 
 
 def verify_totp(secret: str, token: str) -> bool:
     """Verify TOTP token"""
+    import pyotp
     totp = pyotp.TOTP(secret)
     return totp.verify(token, valid_window=1)  # Allow 30 second window
 
 
 def get_totp_uri(secret: str, email: str) -> str:
     """Get TOTP provisioning URI for QR code"""
+    import pyotp
     totp = pyotp.TOTP(secret)
     return totp.provisioning_uri(
         name=email,
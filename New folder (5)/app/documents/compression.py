@@ -1,9 +1,9 @@
 """Image compression utilities optimized for medical documents"""
-from PIL import Image
+import os
 import subprocess
+from PIL import Image
 from pathlib import Path
 from typing import Tuple, Optional
-import tempfile
 
 
 class MedicalImageCompressor:
@@ -20,16 +20,32 @@ class MedicalImageCompressor:
         'jpeg2000': {'quality_mode': 'rates', 'quality_layers': [25]}
     }
     
+    # Lossless WebP is the best fit for text/scanned pages; JPEG2000 is only
+    # worth its encode time for photos WebP didn't already shrink well
+    TRY_JP2_FOR_TEXT = False
+    JP2_SKIP_RATIO = 0.5
+    
+    # Sample size for text/photo classification
+    TEXT_DETECT_SAMPLE_SIZE = (512, 512)
+    
     @classmethod
     def compress_for_storage(cls, image_path: str, 
                            is_text_heavy: bool = True) -> Tuple[str, float]:
         """Compress image for long-term storage"""
         settings = cls.TEXT_HEAVY_SETTINGS if is_text_heavy else cls.PHOTO_SETTINGS
         
+        original_size = Path(image_path).stat().st_size
+        
         # Try WebP first (better browser support)
         webp_path = cls._compress_to_webp(image_path, settings['webp'])
         webp_size = Path(webp_path).stat().st_size
         
+        # JPEG2000 is a multi-second encode on the Pi - only try it when
+        # WebP hasn't already done well
+        if ((is_text_heavy and not cls.TRY_JP2_FOR_TEXT)
+                or webp_size / original_size < cls.JP2_SKIP_RATIO):
+            return webp_path, webp_size / original_size
+        
         # Try JPEG2000 for better compression
         jp2_path = cls._compress_to_jpeg2000(image_path, settings['jpeg2000'])
         jp2_size = Path(jp2_path).stat().st_size if jp2_path else float('inf')
@@ -37,19 +53,31 @@ class MedicalImageCompressor:
         # Choose smaller file
         if jp2_size < webp_size:
             Path(webp_path).unlink()
-            compression_ratio = jp2_size / Path(image_path).stat().st_size
-            return jp2_path, compression_ratio
+            return jp2_path, jp2_size / original_size
         else:
             if jp2_path:
                 Path(jp2_path).unlink()
-            compression_ratio = webp_size / Path(image_path).stat().st_size
-            return webp_path, compression_ratio
+            return webp_path, webp_size / original_size
     
     @staticmethod
     def _compress_to_webp(image_path: str, settings: dict) -> str:
         """Compress to WebP format"""
         output_path = f"{image_path}.webp"
         
+        # Lossy encode is CPU-bound; cwebp -mt spreads it across cores where
+        # there is more than one (no gain on the Pi Zero's single core)
+        if not settings['lossless'] and (os.cpu_count() or 1) > 1:
+            try:
+                subprocess.run(
+                    ['cwebp', '-mt', '-quiet', '-q', str(settings['quality']),
+                     image_path, '-o', output_path],
+                    check=True, capture_output=True
+                )
+                return output_path
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                # cwebp missing or can't read this input - use Pillow
+                pass
+        
         with Image.open(image_path) as img:
             img.save(output_path, 'WEBP', **settings)
         
@@ -57,36 +85,30 @@ class MedicalImageCompressor:
     
     @staticmethod
     def _compress_to_jpeg2000(image_path: str, settings: dict) -> Optional[str]:
-        """Compress to JPEG2000 using OpenJPEG"""
+        """Compress to JPEG2000 using Pillow's OpenJPEG encoder"""
+        output_path = f"{image_path}.jp2"
+        
         try:
-            output_path = f"{image_path}.jp2"
-            
-            # Convert to temporary PPM for OpenJPEG
-            with tempfile.NamedTemporaryFile(suffix='.ppm', delete=False) as tmp:
-                with Image.open(image_path) as img:
-                    img.save(tmp.name, 'PPM')
-                
-                # Use opj_compress for JPEG2000
-                cmd = [
-                    'opj_compress',
-                    '-i', tmp.name,
-                    '-o', output_path,
-                    '-r', ','.join(map(str, settings['quality_layers']))
-                ]
-                
-                subprocess.run(cmd, check=True, capture_output=True)
-                Path(tmp.name).unlink()
+            with Image.open(image_path) as img:
+                img.save(output_path, 'JPEG2000', **settings)
             
             return output_path
             
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # OpenJPEG not available
+        except OSError:
+            # Pillow built without libopenjp2
+            Path(output_path).unlink(missing_ok=True)
             return None
     
-    @staticmethod
-    def is_text_heavy(image_path: str) -> bool:
+    @classmethod
+    def is_text_heavy(cls, image_path: str) -> bool:
         """Detect if image is primarily text"""
         with Image.open(image_path) as img:
+            # Subsample first - the ratio needs the value distribution, not
+            # every pixel. Nearest-neighbour (no draft/averaging) so text
+            # edges aren't blurred into mid-gray.
+            img.thumbnail(cls.TEXT_DETECT_SAMPLE_SIZE, Image.Resampling.NEAREST,
+                          reducing_gap=None)
+            
             # Convert to grayscale
             gray = img.convert('L')
             
@@ -96,7 +118,7 @@ class MedicalImageCompressor:
             # Text images have high contrast (peaks at black/white)
             black_pixels = sum(hist[:50])  # Near black
             white_pixels = sum(hist[200:])  # Near white
-            total_pixels = sum(hist)
+            total_pixels = gray.width * gray.height
             
             contrast_ratio = (black_pixels + white_pixels) / total_pixels
             
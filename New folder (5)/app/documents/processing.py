@@ -1,9 +1,12 @@
 """Document processing pipeline with OCR and compression"""
+import io
 import os
+import shutil
 import tempfile
 import asyncio
 import subprocess
-from typing import Tuple, Optional, Dict, Any
+import threading
+from typing import Tuple, Optional, Dict, Any, List
 from pathlib import Path
 from datetime import datetime
 import pytesseract
@@ -17,10 +20,39 @@ from app.auth.security import FileEncryption, generate_file_key
 from app.audit.logger import log_document_event
 from config.constraints import PI_ZERO_LIMITS
 
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
 
 # Register HEIF opener with Pillow
 pillow_heif.register_heif_opener()
 
+# libmagic database is loaded once; the handle isn't thread-safe
+_MIME = magic.Magic(mime=True)
+_MIME_LOCK = threading.Lock()
+
+# In-process Tesseract keeps the traineddata loaded between documents;
+# one API instance, used by one thread at a time
+_ocr_api = None
+_OCR_LOCK = threading.Lock()
+
+
+def _get_ocr_api(config: str):
+    """Return shared tesserocr API (caller holds _OCR_LOCK)"""
+    global _ocr_api
+    if _ocr_api is None:
+        args = iter(config.split())
+        options = {flag: next(args, None) for flag in args}
+        _ocr_api = PyTessBaseAPI(
+            lang=options.get('-l') or 'eng',
+            psm=int(options.get('--psm') or PSM.AUTO),
+            oem=int(options.get('--oem') or OEM.DEFAULT)
+        )
+    return _ocr_api
+
 
 class DocumentProcessor:
     """Main document processing pipeline optimized for Pi Zero"""
@@ -35,6 +67,10 @@ class DocumentProcessor:
     # OCR optimization settings
     OCR_DPI = 200  # Balanced quality/performance
     OCR_MAX_SIZE = (2000, 2000)  # Limit image size for OCR
+    OCR_CONTRAST = 1.5  # Contrast enhancement factor
+    
+    # Leading bytes kept from the upload for MIME sniffing
+    MIME_SNIFF_SIZE = 4096
     
     def __init__(self):
         self.temp_dir = Path(current_app.config['TEMP_FOLDER'])
@@ -45,6 +81,9 @@ class DocumentProcessor:
             'TESSERACT_CONFIG',
             '--psm 11 -l medical --oem 1'
         )
+        
+        # One OCR at a time per processor - two Tesseracts don't fit in 512 MB
+        self._ocr_slot = asyncio.Semaphore(1)
     
     async def process_upload(self, file_stream, filename: str, 
                            patient_id: int, user_id: int) -> Dict[str, Any]:
@@ -54,10 +93,10 @@ class DocumentProcessor:
         
         try:
             # Step 1: Save temporary file
-            temp_path = await self._save_temp_file(file_stream, filename)
+            temp_path, header = await self._save_temp_file(file_stream, filename)
             
             # Step 2: Validate file type
-            mime_type = self._detect_mime_type(temp_path)
+            mime_type = self._detect_mime_type(header)
             if mime_type not in self.SUPPORTED_FORMATS:
                 raise ValueError(f"Unsupported file type: {mime_type}")
             
@@ -110,8 +149,8 @@ class DocumentProcessor:
                 if path and os.path.exists(path):
                     os.unlink(path)
     
-    async def _save_temp_file(self, file_stream, filename: str) -> str:
-        """Save uploaded file to temporary location"""
+    async def _save_temp_file(self, file_stream, filename: str) -> Tuple[str, bytes]:
+        """Save uploaded file to temporary location, returning its leading bytes"""
         temp_fd, temp_path = tempfile.mkstemp(
             suffix=Path(filename).suffix,
             dir=self.temp_dir
@@ -121,21 +160,46 @@ class DocumentProcessor:
             # Write in chunks to limit memory usage
             chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
             with os.fdopen(temp_fd, 'wb') as f:
-                while True:
-                    chunk = file_stream.read(chunk_size)
-                    if not chunk:
-                        break
-                    f.write(chunk)
+                header = file_stream.read(self.MIME_SNIFF_SIZE)
+                f.write(header)
+                
+                src_fd = self._backing_fd(file_stream)
+                if src_fd is None:
+                    # Spooled upload or in-memory stream (BytesIO)
+                    shutil.copyfileobj(file_stream, f, chunk_size)
+                else:
+                    # Already on disk - copy in-kernel
+                    offset = file_stream.tell()
+                    f.flush()
+                    while True:
+                        sent = os.sendfile(temp_fd, src_fd, offset, chunk_size)
+                        if not sent:
+                            break
+                        offset += sent
             
-            return temp_path
+            return temp_path, header
         except Exception:
             os.unlink(temp_path)
             raise
     
-    def _detect_mime_type(self, file_path: str) -> str:
-        """Detect file MIME type"""
-        mime = magic.Magic(mime=True)
-        return mime.from_file(file_path)
+    @staticmethod
+    def _backing_fd(stream) -> Optional[int]:
+        """Return the stream's fd if it is a real file, else None"""
+        # Werkzeug's FileStorage wraps the actual stream
+        stream = getattr(stream, 'stream', stream)
+        # fileno() on a SpooledTemporaryFile forces it to disk first, which is
+        # the very write we're avoiding - copy spooled uploads in userspace
+        if isinstance(stream, tempfile.SpooledTemporaryFile):
+            return None
+        try:
+            return stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return None
+    
+    def _detect_mime_type(self, header: bytes) -> str:
+        """Detect file MIME type from its leading bytes"""
+        with _MIME_LOCK:
+            return _MIME.from_buffer(header)
     
     async def _process_image(self, image_path: str) -> str:
         """Process and optimize image for OCR and storage"""
@@ -169,15 +233,15 @@ class DocumentProcessor:
     
     def _enhance_for_ocr(self, img: Image.Image) -> Image.Image:
         """Enhance image for better OCR results"""
-        from PIL import ImageEnhance, ImageFilter
+        from PIL import ImageFilter
         
         # Convert to grayscale for text
         if img.mode != 'L':
             img = img.convert('L')
         
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.5)
+        # Enhance contrast - same result as ImageEnhance.Contrast(1.5), but one
+        # lookup-table pass instead of a full-size degenerate image + blend
+        img = img.point(self._contrast_lut(img, self.OCR_CONTRAST))
         
         # Sharpen
         img = img.filter(ImageFilter.SHARPEN)
@@ -187,12 +251,40 @@ class DocumentProcessor:
         
         return img
     
+    @staticmethod
+    def _contrast_lut(img: Image.Image, factor: float) -> List[int]:
+        """Build 8-bit lookup table scaling pixel distance from the image mean"""
+        hist = img.histogram()
+        mean = int(sum(i * count for i, count in enumerate(hist)) / sum(hist) + 0.5)
+        return [
+            min(255, max(0, int(mean + factor * (value - mean) + 0.5)))
+            for value in range(256)
+        ]
+    
     async def _process_pdf(self, pdf_path: str) -> str:
         """Convert PDF to image for OCR"""
         output_path = f"{pdf_path}_page1.png"
         
         try:
-            # Use ImageMagick for PDF conversion (memory efficient)
+            # Rasterize page 1 only with poppler - avoids ImageMagick's
+            # Ghostscript start-up and full page-tree render
+            try:
+                subprocess.run(
+                    ['pdftoppm', '-png', '-singlefile', '-f', '1', '-l', '1',
+                     '-r', str(self.OCR_DPI), pdf_path, output_path[:-len('.png')]],
+                    check=True, capture_output=True
+                )
+                if os.path.isfile(output_path):
+                    return output_path
+                logger.warning("pdftoppm produced no image, falling back to ImageMagick")
+            except FileNotFoundError:
+                # poppler-utils not installed
+                pass
+            except subprocess.CalledProcessError as e:
+                # Corrupt/unusual PDF poppler rejects - ImageMagick may still manage
+                logger.warning(f"pdftoppm failed ({e.returncode}), falling back to ImageMagick")
+            
+            # Fall back to ImageMagick
             with WandImage(filename=f"{pdf_path}[0]", resolution=self.OCR_DPI) as img:
                 img.format = 'png'
                 img.save(filename=output_path)
@@ -213,20 +305,26 @@ class DocumentProcessor:
                 for limit_type, limit_value in limits.items():
                     resource.setrlimit(limit_type, limit_value)
                 
-                # Run OCR
-                data = pytesseract.image_to_data(
-                    image_path,
-                    config=self.tesseract_config,
-                    output_type=pytesseract.Output.DICT
-                )
-                
-                text = pytesseract.image_to_string(
-                    image_path,
-                    config=self.tesseract_config
-                )
+                if TESSEROCR_AVAILABLE:
+                    # Model already resident - no fork or traineddata reload
+                    with _OCR_LOCK:
+                        api = _get_ocr_api(self.tesseract_config)
+                        api.SetImageFile(image_path)
+                        text = api.GetUTF8Text()
+                        data = {'conf': api.AllWordConfidences()}
+                else:
+                    # Run OCR - one Tesseract pass; text is rebuilt from the
+                    # word boxes rather than loading the model a second time
+                    data = pytesseract.image_to_data(
+                        image_path,
+                        config=self.tesseract_config,
+                        output_type=pytesseract.Output.DICT
+                    )
+                    
+                    text = self._text_from_ocr_data(data)
                 
                 # Calculate average confidence
-                confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+                confidences = [float(conf) for conf in data['conf'] if float(conf) > 0]
                 avg_confidence = sum(confidences) / len(confidences) if confidences else 0
                 
                 return {
@@ -235,12 +333,19 @@ class DocumentProcessor:
                     'confidence': avg_confidence
                 }
             
-            # Run in thread pool with timeout
+            # Run in thread pool with timeout (queued time doesn't count)
             loop = asyncio.get_event_loop()
-            result = await asyncio.wait_for(
-                loop.run_in_executor(None, run_tesseract),
-                timeout=PI_ZERO_LIMITS.OCR_TIMEOUT
-            )
+            async with self._ocr_slot:
+                ocr_future = loop.run_in_executor(None, run_tesseract)
+                try:
+                    result = await asyncio.wait_for(
+                        asyncio.shield(ocr_future),
+                        timeout=PI_ZERO_LIMITS.OCR_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    # Hold the slot until the abandoned Tesseract run exits
+                    await asyncio.wait([ocr_future])
+                    raise
             
             return result
             
@@ -251,6 +356,19 @@ class DocumentProcessor:
             logger.error(f"OCR failed: {str(e)}")
             return {'text': '', 'confidence': 0, 'error': str(e)}
     
+    @staticmethod
+    def _text_from_ocr_data(data: Dict[str, list]) -> str:
+        """Join recognised words from image_to_data output into lines"""
+        lines: Dict[Tuple[int, int, int], list] = {}
+        for i, word in enumerate(data['text']):
+            # conf is -1 on page/block/line rows that carry no word
+            if not word.strip() or float(data['conf'][i]) < 0:
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+        
+        return '\n'.join(' '.join(words) for words in lines.values())
+    
     async def _encrypt_document(self, image_path: str, ocr_result: Dict[str, Any],
                                patient_id: int, user_id: int) -> Dict[str, Any]:
         """Encrypt document and OCR text"""
@@ -269,9 +387,9 @@ class DocumentProcessor:
         enc_image_path = f"{image_path}.enc"
         encrypted_image, nonce = encryptor.encrypt_file(image_path, enc_image_path)
         
-        # Encrypt OCR text
+        # Encrypt OCR text (self-describing blob with its own nonce)
         ocr_text = ocr_result.get('text', '').encode('utf-8')
-        encrypted_text = encryptor.aesgcm.encrypt(nonce, ocr_text, None)
+        encrypted_text = encryptor.encrypt_bytes(ocr_text)
         
         return {
             'encrypted_image_path': encrypted_image,
@@ -305,7 +423,6 @@ class DocumentProcessor:
         # Save encrypted OCR text
         text_path = patient_folder / f"doc_{doc.id}_ocr.enc"
         with open(text_path, 'wb') as f:
-            f.write(encrypted_data['nonce'])
             f.write(encrypted_data['encrypted_text'])
         
         # Update document record
@@ -3,12 +3,29 @@ import os
 import shutil
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any, Tuple
 from flask import current_app
 from app import db, logger
 from app.patient.models import Patient, PatientDocument
 
 
+def scan_tree(path: str) -> Tuple[int, int]:
+    """Return (total bytes, file count) under path using scandir"""
+    total_size = 0
+    file_count = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                # DirEntry caches stat; no Path object per file
+                total_size += entry.stat(follow_symlinks=False).st_size
+                file_count += 1
+            elif entry.is_dir(follow_symlinks=False):
+                sub_size, sub_count = scan_tree(entry.path)
+                total_size += sub_size
+                file_count += sub_count
+    return total_size, file_count
+
+
 class PatientStorageManager:
     """Manage patient document storage with HIPAA compliance"""
     
@@ -34,13 +51,7 @@ class PatientStorageManager:
         """Calculate storage usage for a patient"""
         folder = self.get_patient_folder(patient_id)
         
-        total_size = 0
-        file_count = 0
-        
-        for file_path in folder.rglob('*'):
-            if file_path.is_file():
-                total_size += file_path.stat().st_size
-                file_count += 1
+        total_size, file_count = scan_tree(folder)
         
         return {
             'total_size_mb': round(total_size / (1024 * 1024), 2),
@@ -94,18 +105,15 @@ class PatientStorageManager:
         timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
         backup_name = f"psyward_backup_{timestamp}"
         
-        # Create backup archive
-        temp_archive = Path('/tmp') / f"{backup_name}.tar"
+        encrypted_backup = self.backup_path / f"{backup_name}.enc"
         
         try:
-            # Create tar archive
+            # Stream tar straight into the encryptor - no plaintext copy of
+            # the patient data on disk, and the dataset is written only once
             import tarfile
-            with tarfile.open(temp_archive, 'w') as tar:
-                tar.add(self.base_path, arcname='patient_data')
-            
-            # Encrypt backup
-            encrypted_backup = self.backup_path / f"{backup_name}.enc"
-            encryptor.encrypt_file(str(temp_archive), str(encrypted_backup))
+            with encryptor.open_writer(str(encrypted_backup)) as sink:
+                with tarfile.open(fileobj=sink, mode='w|') as tar:
+                    tar.add(self.base_path, arcname='patient_data')
             
             # Save backup key (should be stored securely offline)
             key_file = self.backup_path / f"{backup_name}.key"
@@ -124,29 +132,38 @@ class PatientStorageManager:
                 'timestamp': timestamp
             }
             
-        finally:
-            # Cleanup temp file
-            if temp_archive.exists():
-                temp_archive.unlink()
+        except Exception:
+            # Don't leave an incomplete backup behind
+            encrypted_backup.unlink(missing_ok=True)
+            raise
     
     def verify_storage_integrity(self) -> List[Dict[str, Any]]:
         """Verify integrity of stored documents"""
         issues = []
         
-        # Check all patient documents
-        documents = PatientDocument.query.filter_by(archived=False).all()
+        # Check all patient documents - only the columns needed, streamed
+        documents = db.session.query(
+            PatientDocument.id,
+            PatientDocument.file_path,
+            PatientDocument.text_path,
+            PatientDocument.file_size
+        ).filter_by(archived=False).yield_per(500)
         
         for doc in documents:
-            # Check file existence
-            if doc.file_path and not Path(doc.file_path).exists():
-                issues.append({
-                    'document_id': doc.id,
-                    'issue': 'missing_file',
-                    'path': doc.file_path
-                })
+            # Check file existence (one stat gives existence and size)
+            actual_size = None
+            if doc.file_path:
+                try:
+                    actual_size = os.stat(doc.file_path).st_size
+                except FileNotFoundError:
+                    issues.append({
+                        'document_id': doc.id,
+                        'issue': 'missing_file',
+                        'path': doc.file_path
+                    })
             
             # Check text file
-            if doc.text_path and not Path(doc.text_path).exists():
+            if doc.text_path and not os.path.exists(doc.text_path):
                 issues.append({
                     'document_id': doc.id,
                     'issue': 'missing_ocr',
@@ -154,14 +171,12 @@ class PatientStorageManager:
                 })
             
             # Verify file size matches
-            if doc.file_path and Path(doc.file_path).exists():
-                actual_size = Path(doc.file_path).stat().st_size
-                if actual_size != doc.file_size:
-                    issues.append({
-                        'document_id': doc.id,
-                        'issue': 'size_mismatch',
-                        'expected': doc.file_size,
-                        'actual': actual_size
-                    })
+            if actual_size is not None and actual_size != doc.file_size:
+                issues.append({
+                    'document_id': doc.id,
+                    'issue': 'size_mismatch',
+                    'expected': doc.file_size,
+                    'actual': actual_size
+                })
         
         return issues
\ No newline at end of file
@@ -1,10 +1,27 @@
 """Patient data models with PHI protection"""
-from datetime import datetime
-from typing import Optional, List
-from sqlalchemy import Index, func
+import queue
+import atexit
+import threading
+from datetime import datetime, date
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import Index, func, text, cast, case, event, update, bindparam
 from sqlalchemy.ext.hybrid import hybrid_property
 from app import db
 
+# Document views are counted in memory and written in one batched UPDATE
+ACCESS_FLUSH_INTERVAL = 30  # seconds
+_access_buffer: Dict[int, Tuple[int, datetime]] = {}  # doc id -> (views, last view)
+_access_lock = threading.Lock()
+_access_flush_stop = threading.Event()
+_access_flush_thread: Optional[threading.Thread] = None
+
+# PatientAccessLog rows are queued and inserted in batches by one writer
+ACCESS_LOG_BATCH_SIZE = 100
+ACCESS_LOG_WAIT = 1.0  # seconds to wait for the first row of a batch
+_access_log_queue: 'queue.Queue[dict]' = queue.Queue()
+_access_log_stop = threading.Event()
+_access_log_thread: Optional[threading.Thread] = None
+
 
 class Patient(db.Model):
     """Patient model with HIPAA-compliant data storage"""
@@ -18,6 +35,8 @@ class Patient(db.Model):
     last_name = db.Column(db.String(100), nullable=False)
     middle_name = db.Column(db.String(100))
     date_of_birth = db.Column(db.Date, nullable=False)
+    # lower("first last"), kept by events; NOCASE so LIKE 'prefix%' can use the index
+    search_name = db.Column(db.String(201, collation='NOCASE'), index=True)
     ssn_encrypted = db.Column(db.LargeBinary)  # Extra encryption for SSN
     
     # Contact information
@@ -59,11 +78,12 @@ class Patient(db.Model):
     access_logs = db.relationship('PatientAccessLog', backref='patient',
                                 cascade='all, delete-orphan')
     
-    # Indexes for search performance
+    # Indexes for search performance. NOCASE so case-insensitive LIKE 'prefix%'
+    # seeks them; nothing looks patients up by date_of_birth, so it isn't indexed
     __table_args__ = (
-        Index('idx_patient_name', 'last_name', 'first_name'),
+        Index('idx_patient_last_name', last_name.collate('NOCASE')),
+        Index('idx_patient_first_name', first_name.collate('NOCASE')),
         Index('idx_patient_mrn', 'mrn'),
-        Index('idx_patient_dob', 'date_of_birth'),
     )
     
     @hybrid_property
@@ -75,8 +95,23 @@ class Patient(db.Model):
     @hybrid_property
     def age(self) -> int:
         """Calculate patient age"""
-        from datetime import date
-        today = date.today()
+        return self.age_on(date.today())
+    
+    @age.expression
+    def age(cls):
+        """Same calculation in SQL (SQLite) so filters/sorts by age stay in the database"""
+        today = ('now', 'localtime')
+        return (
+            cast(func.strftime('%Y', *today), db.Integer)
+            - cast(func.strftime('%Y', cls.date_of_birth), db.Integer)
+            - case(
+                (func.strftime('%m-%d', *today) < func.strftime('%m-%d', cls.date_of_birth), 1),
+                else_=0
+            )
+        )
+    
+    def age_on(self, today: date) -> int:
+        """Patient age on the given date (lets list views share one today)"""
         return today.year - self.date_of_birth.year - (
             (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day)
         )
@@ -85,13 +120,13 @@ class Patient(db.Model):
         """Return redacted SSN for display"""
         return "XXX-XX-XXXX"
     
-    def to_dict(self, include_phi: bool = False) -> dict:
+    def to_dict(self, include_phi: bool = False, today: Optional[date] = None) -> dict:
         """Convert to dictionary with PHI control"""
         data = {
             'id': self.id,
             'mrn': self.mrn if include_phi else 'REDACTED',
             'full_name': self.full_name if include_phi else 'REDACTED',
-            'age': self.age,
+            'age': self.age_on(today or date.today()),
             'ward': self.ward,
             'treating_physician': self.treating_physician,
             'is_active': self.is_active
@@ -113,6 +148,73 @@ class Patient(db.Model):
             })
         
         return data
+    
+    @classmethod
+    def list_to_dicts(cls, patients: List['Patient'], include_phi: bool = False) -> List[dict]:
+        """Serialize many patients at once (same shape as to_dict)"""
+        today = date.today()
+        if include_phi:
+            return [patient.to_dict(include_phi=True, today=today) for patient in patients]
+        
+        # Redacted rows - branch hoisted out of the loop, nothing PHI is read
+        return [
+            {
+                'id': patient.id,
+                'mrn': 'REDACTED',
+                'full_name': 'REDACTED',
+                'age': patient.age_on(today),
+                'ward': patient.ward,
+                'treating_physician': patient.treating_physician,
+                'is_active': patient.is_active
+            }
+            for patient in patients
+        ]
+
+
+def patient_search_name(first_name: Optional[str], last_name: Optional[str]) -> str:
+    """Normalized "first last" name used for patient search"""
+    return f"{first_name or ''} {last_name or ''}".lower()
+
+
+@event.listens_for(Patient, 'before_insert')
+@event.listens_for(Patient, 'before_update')
+def _set_search_name(mapper, connection, target: Patient):
+    """Keep search_name in step with first/last name"""
+    target.search_name = patient_search_name(target.first_name, target.last_name)
+
+
+def ensure_added_columns(engine):
+    """Add columns and indexes missing from tables created before they existed"""
+    # create_all only creates missing tables, it never alters existing ones
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    with engine.begin() as conn:
+        for column in _ADDED_COLUMNS:
+            table = column.table
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            if column.name in existing:
+                continue
+            
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            for index in table.indexes:
+                if any(c is column for c in index.columns):
+                    index.create(conn, checkfirst=True)
+        
+        for index in _ADDED_INDEXES:
+            index.create(conn, checkfirst=True)
+
+
+def backfill_patient_search_names() -> int:
+    """Fill search_name for rows written before the column existed"""
+    count = 0
+    for patient in Patient.query.filter(Patient.search_name.is_(None)).yield_per(500):
+        patient.search_name = patient_search_name(patient.first_name, patient.last_name)
+        count += 1
+    if count:
+        db.session.commit()
+    return count
 
 
 class PatientDocument(db.Model):
@@ -154,20 +256,144 @@ class PatientDocument(db.Model):
     
     # Full-text search
     search_text = db.Column(db.Text)  # Indexed OCR text (sanitized)
+    ocr_text_sha = db.Column(db.LargeBinary(32))  # SHA-256 of the OCR text behind search_text
     
     # Indexes
     __table_args__ = (
-        Index('idx_document_patient', 'patient_id'),
+        # patient_id-led composites also serve plain patient_id lookups
+        Index('idx_document_patient_date', 'patient_id', 'document_date', 'archived'),
+        # Per-patient search: active docs in date order, no sort step
+        Index('idx_document_active', 'patient_id', 'document_date',
+              sqlite_where=text('archived = 0')),
         Index('idx_document_type', 'document_type'),
         Index('idx_document_date', 'document_date'),
-        Index('idx_document_search', 'search_text'),  # Full-text search
+        # Full-text search is served by DOCUMENT_FTS_TABLE (FTS5), not a B-tree
+        Index('idx_document_uploaded', 'uploaded_at'),
+        # Partial index - only the (small) OCR backlog is indexed
+        Index('idx_document_ocr_pending', 'ocr_processed',
+              sqlite_where=text('ocr_processed = 0')),
     )
     
     def increment_access(self):
-        """Track document access"""
-        self.access_count += 1
-        self.last_accessed = datetime.utcnow()
-        db.session.commit()
+        """Track document access (buffered; see flush_document_access)"""
+        with _access_lock:
+            views, _ = _access_buffer.get(self.id, (0, None))
+            _access_buffer[self.id] = (views + 1, datetime.utcnow())
+
+
+# Columns and indexes added to existing tables after release (see ensure_added_columns)
+_ADDED_COLUMNS = (
+    Patient.__table__.c.search_name,
+    PatientDocument.__table__.c.ocr_text_sha,
+)
+_ADDED_INDEXES = tuple(
+    index for index in Patient.__table__.indexes
+    if index.name in ('idx_patient_last_name', 'idx_patient_first_name')
+)
+
+
+def flush_document_access() -> int:
+    """Write buffered document view counts in a single executemany UPDATE"""
+    with _access_lock:
+        if not _access_buffer:
+            return 0
+        pending = [
+            {'doc_id': doc_id, 'delta': views, 'ts': last_view}
+            for doc_id, (views, last_view) in _access_buffer.items()
+        ]
+        _access_buffer.clear()
+    
+    table = PatientDocument.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('doc_id')).values(
+            access_count=func.coalesce(table.c.access_count, 0) + bindparam('delta'),
+            last_accessed=bindparam('ts')
+        ),
+        pending
+    )
+    db.session.commit()
+    return len(pending)
+
+
+def _access_flush_worker(app):
+    """Flush document view counts every ACCESS_FLUSH_INTERVAL until stopped"""
+    from app import logger
+    
+    while not _access_flush_stop.wait(ACCESS_FLUSH_INTERVAL):
+        with app.app_context():
+            try:
+                flush_document_access()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Document access flush failed: {str(e)}")
+
+
+def _flush_document_access_at_exit(app):
+    """Write whatever view counts are still buffered before the process exits"""
+    stop_access_flush()
+    with app.app_context():
+        flush_document_access()
+
+
+def start_access_flush(app):
+    """Start background document access flushing (call once at app startup)"""
+    global _access_flush_thread
+    if _access_flush_thread is not None:
+        return
+    
+    _access_flush_stop.clear()
+    _access_flush_thread = threading.Thread(target=_access_flush_worker, args=(app,), daemon=True)
+    _access_flush_thread.start()
+    atexit.register(_flush_document_access_at_exit, app)
+
+
+def stop_access_flush():
+    """Signal background access flushing to exit"""
+    global _access_flush_thread
+    _access_flush_stop.set()
+    if _access_flush_thread is not None:
+        _access_flush_thread.join(timeout=5)
+        _access_flush_thread = None
+
+
+# FTS5 index over PatientDocument.search_text. External-content table, so the
+# text isn't stored twice; triggers keep it in sync. SQLAlchemy can't declare
+# virtual tables, so create_app runs this after create_all.
+DOCUMENT_FTS_TABLE = 'patient_documents_fts'
+_DOCUMENT_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {DOCUMENT_FTS_TABLE} USING fts5("
+    f"search_text, content='patient_documents', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS patient_documents_fts_ai AFTER INSERT ON patient_documents "
+    f"BEGIN INSERT INTO {DOCUMENT_FTS_TABLE}(rowid, search_text) "
+    f"VALUES (new.id, new.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS patient_documents_fts_ad AFTER DELETE ON patient_documents "
+    f"BEGIN INSERT INTO {DOCUMENT_FTS_TABLE}({DOCUMENT_FTS_TABLE}, rowid, search_text) "
+    f"VALUES ('delete', old.id, old.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS patient_documents_fts_au AFTER UPDATE OF search_text "
+    f"ON patient_documents "
+    f"BEGIN INSERT INTO {DOCUMENT_FTS_TABLE}({DOCUMENT_FTS_TABLE}, rowid, search_text) "
+    f"VALUES ('delete', old.id, old.search_text); "
+    f"INSERT INTO {DOCUMENT_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+)
+
+
+def ensure_document_fts(engine):
+    """Create document FTS5 table and sync triggers, backfilling on first run"""
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    with engine.begin() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (DOCUMENT_FTS_TABLE,)
+        ).scalar()
+        for statement in _DOCUMENT_FTS_DDL:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            # Index documents that were OCR'd before the FTS table existed
+            conn.exec_driver_sql(
+                f"INSERT INTO {DOCUMENT_FTS_TABLE}({DOCUMENT_FTS_TABLE}) VALUES ('rebuild')"
+            )
 
 
 class PatientAccessLog(db.Model):
@@ -201,4 +427,97 @@ class PatientAccessLog(db.Model):
         Index('idx_access_patient', 'patient_id'),
         Index('idx_access_user', 'user_id'),
         Index('idx_access_time', 'accessed_at'),
-    )
\ No newline at end of file
+    )
+
+
+_ACCESS_LOG_FIELDS = (
+    'patient_id', 'user_id', 'access_type', 'accessed_at', 'ip_address', 'user_agent',
+    'fields_accessed', 'document_id', 'is_emergency', 'emergency_reason'
+)
+
+
+def queue_patient_access(*, patient_id: int, user_id: int, access_type: str, **details) -> None:
+    """Queue a PatientAccessLog row (inserted by the access log writer)"""
+    # Keyword-only: audit.logger.log_patient_access takes (user_id, patient_id)
+    unknown = details.keys() - set(_ACCESS_LOG_FIELDS)
+    if unknown:
+        raise TypeError(f"Unknown access log fields: {', '.join(sorted(unknown))}")
+    
+    # Every row carries every column so the batch is one executemany
+    row = dict.fromkeys(_ACCESS_LOG_FIELDS)
+    row.update(is_emergency=False, accessed_at=datetime.utcnow())
+    row.update(details, patient_id=patient_id, user_id=user_id, access_type=access_type)
+    _access_log_queue.put(row)
+
+
+def _take_access_log_batch(wait: Optional[float]) -> List[dict]:
+    """Pop up to ACCESS_LOG_BATCH_SIZE queued rows, waiting only for the first"""
+    batch = []
+    try:
+        batch.append(_access_log_queue.get(timeout=wait) if wait else _access_log_queue.get_nowait())
+        while len(batch) < ACCESS_LOG_BATCH_SIZE:
+            batch.append(_access_log_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return batch
+
+
+def flush_access_log() -> int:
+    """Insert every queued access log row now (batched, one commit per batch)"""
+    written = 0
+    while True:
+        batch = _take_access_log_batch(wait=None)
+        if not batch:
+            return written
+        db.session.execute(PatientAccessLog.__table__.insert(), batch)
+        db.session.commit()
+        written += len(batch)
+
+
+def _access_log_worker(app):
+    """Insert queued access log rows in batches until stopped"""
+    from app import logger
+    
+    while not _access_log_stop.is_set():
+        batch = _take_access_log_batch(wait=ACCESS_LOG_WAIT)
+        if not batch:
+            continue
+        with app.app_context():
+            try:
+                db.session.execute(PatientAccessLog.__table__.insert(), batch)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Access log insert failed ({len(batch)} rows requeued): {str(e)}")
+                # HIPAA - keep the rows and retry on the next pass
+                for row in batch:
+                    _access_log_queue.put(row)
+                _access_log_stop.wait(ACCESS_LOG_WAIT)
+
+
+def _flush_access_log_at_exit(app):
+    """Write whatever is still queued before the process exits"""
+    stop_access_log_writer()
+    with app.app_context():
+        flush_access_log()
+
+
+def start_access_log_writer(app):
+    """Start background access log writer (call once at app startup)"""
+    global _access_log_thread
+    if _access_log_thread is not None:
+        return
+    
+    _access_log_stop.clear()
+    _access_log_thread = threading.Thread(target=_access_log_worker, args=(app,), daemon=True)
+    _access_log_thread.start()
+    atexit.register(_flush_access_log_at_exit, app)
+
+
+def stop_access_log_writer():
+    """Signal background access log writer to exit"""
+    global _access_log_thread
+    _access_log_stop.set()
+    if _access_log_thread is not None:
+        _access_log_thread.join(timeout=5)
+        _access_log_thread = None
@@ -1,13 +1,60 @@
 """Patient and document search functionality"""
 import re
+import hashlib
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, text, column
+from sqlalchemy.orm import selectinload
 from app import db
-from app.patient.models import Patient, PatientDocument
+from app.patient.models import Patient, PatientDocument, DOCUMENT_FTS_TABLE
 from app.audit.logger import log_search_event
 
 
+# Search/index patterns compiled once at import
+_MRN_RE = re.compile(r'^[A-Z0-9]+$')
+_FTS_TOKEN_RE = re.compile(r'\w+')
+_LIKE_ESCAPE = str.maketrans({'\\': '\\\\', '%': '\\%', '_': '\\_'})
+_WS_RE = re.compile(r'\s+')
+_SSN_RE = re.compile(r'\b\d{3}-?\d{2}-?\d{4}\b')
+_PHONE_RE = re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b')
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_DATE_RE = re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b')
+_MRN_DIGITS_RE = re.compile(r'\b\d{6,10}\b')
+_SANITIZE_RE = re.compile(r'[^\w\s\-.]')
+_NORMALIZE_RE = re.compile(r'[^\w\s\-\.\/\#]')
+
+
+def _ascii_filter_table(extra: str, repl: Optional[str]) -> Dict[int, Optional[str]]:
+    """str.translate table mapping ASCII other than word chars, whitespace and `extra` to `repl`"""
+    # Same tests as the regex \w / \s classes; non-ASCII code points aren't in
+    # the table, so translate() leaves them as-is
+    return {
+        code: repl for code, ch in enumerate(map(chr, range(128)))
+        if not (ch.isalnum() or ch.isspace() or ch in extra or ch == '_')
+    }
+
+
+# Query allow-list: word chars, whitespace, '-' and '.'; everything else is dropped
+_SANITIZE_TABLE = _ascii_filter_table('-.', None)
+# Everything outside word chars, whitespace and medical notation becomes a space
+_NORMALIZE_TABLE = _ascii_filter_table('-./#', ' ')
+
+# All PHI redactions in one alternation so OCR text is scanned once; order
+# matters (SSN before MRN so 9-digit runs are tagged as SSNs)
+_PHI_TAGS = {
+    'ssn': (_SSN_RE, '[SSN]'),
+    'phone': (_PHONE_RE, '[PHONE]'),
+    'email': (_EMAIL_RE, '[EMAIL]'),
+    'date': (_DATE_RE, '[DATE]'),  # but keep years
+    'mrn': (_MRN_DIGITS_RE, '[MRN]'),  # potential MRNs (6-10 digit numbers)
+}
+# Every PHI pattern needs a digit or '@' - text with neither skips the scan
+_PHI_HINT_RE = re.compile(r'[\d@]')
+_PHI_UNION_RE = re.compile('|'.join(
+    f'(?P<{name}>{pattern.pattern})' for name, (pattern, _) in _PHI_TAGS.items()
+))
+
+
 class PatientSearchEngine:
     """Search engine for patients and documents"""
     
@@ -19,6 +66,8 @@ class PatientSearchEngine:
         'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
     }
     
+    PATIENT_RESULT_LIMIT = 50
+    
     @classmethod
     def search_patients(cls, query: str, user_id: int, 
                        include_inactive: bool = False) -> List[Patient]:
@@ -29,29 +78,35 @@ class PatientSearchEngine:
         # Log search
         log_search_event('PATIENT_SEARCH', user_id, {'query': query})
         
-        # Build search conditions
-        conditions = []
-        
-        # Search by name
-        name_condition = or_(
-            func.lower(Patient.first_name).contains(query.lower()),
-            func.lower(Patient.last_name).contains(query.lower()),
-            func.lower(func.concat(Patient.first_name, ' ', Patient.last_name)).contains(query.lower())
-        )
-        conditions.append(name_condition)
+        # Search by name - index-seekable prefix matches on last name, first
+        # name and, for "first last" queries, the joined name
+        name_pattern = query.lower().translate(_LIKE_ESCAPE)
+        prefix = f"{name_pattern}%"
+        conditions = [
+            Patient.last_name.like(prefix, escape='\\'),
+            Patient.first_name.like(prefix, escape='\\'),
+        ]
+        if ' ' in query.strip():
+            conditions.append(Patient.search_name.like(prefix, escape='\\'))
         
         # Search by MRN (exact match only for security)
-        if re.match(r'^[A-Z0-9]+$', query.upper()):
+        if _MRN_RE.match(query.upper()):
             conditions.append(Patient.mrn == query.upper())
         
         # Active status filter
+        base_query = Patient.query
         if not include_inactive:
-            base_condition = and_(Patient.is_active == True, or_(*conditions))
-        else:
-            base_condition = or_(*conditions)
+            base_query = base_query.filter(Patient.is_active == True)
         
         # Execute search
-        results = Patient.query.filter(base_condition).limit(50).all()
+        results = base_query.filter(or_(*conditions)).limit(cls.PATIENT_RESULT_LIMIT).all()
+        
+        # Substring matches anywhere in "first last" fill the remaining slots
+        if len(results) < cls.PATIENT_RESULT_LIMIT:
+            results += base_query.filter(
+                Patient.search_name.like(f"%{name_pattern}%", escape='\\'),
+                Patient.id.notin_([patient.id for patient in results])
+            ).limit(cls.PATIENT_RESULT_LIMIT - len(results)).all()
         
         return results
     
@@ -68,8 +123,10 @@ class PatientSearchEngine:
             'patient_id': patient_id
         })
         
-        # Build base query
-        base_query = PatientDocument.query.filter(
+        # Build base query (patients fetched in one batched SELECT, not per row)
+        base_query = PatientDocument.query.options(
+            selectinload(PatientDocument.patient)
+        ).filter(
             PatientDocument.archived == False
         )
         
@@ -79,13 +136,15 @@ class PatientSearchEngine:
                 PatientDocument.patient_id == patient_id
             )
         
-        # Search in OCR text (using indexed search_text field)
+        # Search in OCR text (FTS5 index over search_text)
         if query:
-            # Use PostgreSQL-style full text search on SQLite
-            search_condition = func.lower(PatientDocument.search_text).contains(
-                query.lower()
-            )
-            base_query = base_query.filter(search_condition)
+            match = cls._fts_match_query(query)
+            if not match:
+                return []
+            fts_rows = text(
+                f"SELECT rowid FROM {DOCUMENT_FTS_TABLE} WHERE {DOCUMENT_FTS_TABLE} MATCH :match"
+            ).bindparams(match=match).columns(column('rowid'))
+            base_query = base_query.filter(PatientDocument.id.in_(fts_rows))
         
         # Order by relevance (simple implementation)
         results = base_query.order_by(
@@ -101,15 +160,16 @@ class PatientSearchEngine:
         # For Pi Zero, we keep it simple
         results = []
         
-        # Search patients
-        patients = cls.search_patients(query, user_id=1, include_inactive=True)
-        for patient in patients[:10]:
+        # Search patients (scored as one batch - query is normalized once)
+        patients = cls.search_patients(query, user_id=1, include_inactive=True)[:10]
+        names = [patient.full_name for patient in patients]
+        for patient, name, score in zip(patients, names, cls._score_batch(query, names)):
             results.append({
                 'type': 'patient',
                 'id': patient.id,
-                'title': patient.full_name,
+                'title': name,
                 'subtitle': f"MRN: {patient.mrn}",
-                'score': cls._calculate_relevance(query, patient.full_name)
+                'score': score
             })
         
         # Search recent documents
@@ -131,17 +191,34 @@ class PatientSearchEngine:
     @staticmethod
     def _sanitize_query(query: str) -> str:
         """Sanitize search query to prevent injection"""
-        # Remove special characters that could break search
-        sanitized = re.sub(r'[^\w\s\-.]', '', query)
-        # Limit length
-        return sanitized[:100]
+        # Limit length, then remove special characters that could break search
+        sanitized = query[:100].translate(_SANITIZE_TABLE)
+        if not sanitized.isascii():
+            # \w is Unicode-aware - let the regex judge the non-ASCII rest
+            sanitized = _SANITIZE_RE.sub('', sanitized)
+        return sanitized
     
     @staticmethod
-    def _calculate_relevance(query: str, text: str) -> float:
+    def _fts_match_query(query: str) -> str:
+        """Build FTS5 MATCH expression: every term must appear, as a word prefix"""
+        # Quoted so FTS5 operators/syntax in user input are taken literally
+        return ' '.join(f'"{term}"*' for term in _FTS_TOKEN_RE.findall(query))
+    
+    @classmethod
+    def _calculate_relevance(cls, query: str, text: str) -> float:
         """Simple relevance scoring"""
+        return cls._score_batch(query, [text])[0]
+    
+    @classmethod
+    def _score_batch(cls, query: str, texts: List[str]) -> List[float]:
+        """Score many texts against one query, lowering/splitting the query once"""
         query_lower = query.lower()
-        text_lower = text.lower()
-        
+        query_words = set(query_lower.split())
+        return [cls._relevance(query_lower, query_words, text.lower()) for text in texts]
+    
+    @staticmethod
+    def _relevance(query_lower: str, query_words: set, text_lower: str) -> float:
+        """Relevance of already-lowercased text to already-lowercased query"""
         # Exact match
         if query_lower == text_lower:
             return 1.0
@@ -154,10 +231,8 @@ class PatientSearchEngine:
         if query_lower in text_lower:
             return 0.7
         
-        # Word match
-        query_words = set(query_lower.split())
-        text_words = set(text_lower.split())
-        if query_words.intersection(text_words):
+        # Word match (isdisjoint stops at the first shared word, no text set built)
+        if not query_words.isdisjoint(text_lower.split()):
             return 0.5
         
         return 0.0
@@ -183,9 +258,25 @@ class MedicalOCRIndexer:
         'qid': 'four times daily'
     }
     
+    # Whole whitespace-delimited words only (not 'pt' inside 'pt.' or 'pt-2')
+    _ABBR_RE = re.compile(
+        r'(?<!\S)(' + '|'.join(map(re.escape, MEDICAL_ABBREVIATIONS)) + r')(?!\S)'
+    )
+    # Finished "expansion abbr" replacements, so each hit is one dict lookup
+    _ABBR_REPLACEMENTS = {
+        abbr: f"{expansion} {abbr}" for abbr, expansion in MEDICAL_ABBREVIATIONS.items()
+    }
+    
     @classmethod
     def index_document_text(cls, document_id: int, ocr_text: str) -> str:
         """Process and index OCR text for search"""
+        doc = PatientDocument.query.get(document_id)
+        
+        # Re-running OCR often yields identical text - skip the rework
+        text_sha = hashlib.sha256(ocr_text.encode('utf-8')).digest()
+        if doc and doc.ocr_processed and doc.ocr_text_sha == text_sha:
+            return doc.search_text or ''
+        
         # Clean and normalize text
         processed_text = cls._normalize_text(ocr_text)
         
@@ -196,9 +287,9 @@ class MedicalOCRIndexer:
         processed_text = cls._remove_phi(processed_text)
         
         # Update document search field
-        doc = PatientDocument.query.get(document_id)
         if doc:
             doc.search_text = processed_text
+            doc.ocr_text_sha = text_sha
             doc.ocr_processed = True
             db.session.commit()
         
@@ -207,49 +298,24 @@ class MedicalOCRIndexer:
     @classmethod
     def _normalize_text(cls, text: str) -> str:
         """Normalize text for consistent search"""
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Replace multiple spaces with single space
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove special characters but keep medical notation
-        text = re.sub(r'[^\w\s\-\.\/\#]', ' ', text)
-        
-        return text.strip()
+        # Lowercase, blank out special characters (keeping medical notation),
+        # then collapse whitespace once
+        text = text.lower().translate(_NORMALIZE_TABLE)
+        if not text.isascii():
+            # \w is Unicode-aware - let the regex judge the non-ASCII rest
+            text = _NORMALIZE_RE.sub(' ', text)
+        return _WS_RE.sub(' ', text).strip()
     
     @classmethod
     def _expand_abbreviations(cls, text: str) -> str:
         """Expand common medical abbreviations"""
-        words = text.split()
-        expanded_words = []
-        
-        for word in words:
-            # Check if word is an abbreviation
-            if word in cls.MEDICAL_ABBREVIATIONS:
-                expanded_words.append(cls.MEDICAL_ABBREVIATIONS[word])
-                expanded_words.append(word)  # Keep original too
-            else:
-                expanded_words.append(word)
-        
-        return ' '.join(expanded_words)
+        # Keep original too
+        replacements = cls._ABBR_REPLACEMENTS
+        return cls._ABBR_RE.sub(lambda m: replacements[m.group(1)], text)
     
     @classmethod
     def _remove_phi(cls, text: str) -> str:
         """Remove PHI from text before indexing"""
-        # Remove SSNs
-        text = re.sub(r'\b\d{3}-?\d{2}-?\d{4}\b', '[SSN]', text)
-        
-        # Remove phone numbers
-        text = re.sub(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', '[PHONE]', text)
-        
-        # Remove email addresses
-        text = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', '[EMAIL]', text)
-        
-        # Remove dates (but keep years)
-        text = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', '[DATE]', text)
-        
-        # Remove potential MRNs (6-10 digit numbers)
-        text = re.sub(r'\b\d{6,10}\b', '[MRN]', text)
-        
-        return text
\ No newline at end of file
+        if not _PHI_HINT_RE.search(text):
+            return text
+        return _PHI_UNION_RE.sub(lambda m: _PHI_TAGS[m.lastgroup][1], text)
\ No newline at end of file
@@ -52,6 +52,9 @@ class ProductionConfig:
     RATELIMIT_DEFAULT = "100 per hour"
     RATELIMIT_HEADERS_ENABLED = True
     
+    # Redis (metrics snapshot published by the background sampler)
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    
     # Audit log
     AUDIT_LOG_PATH = '/var/log/psyward/audit.log'
     AUDIT_LOG_RETENTION_DAYS = 2555  # 7 years HIPAA requirement
@@ -61,6 +64,11 @@ class ProductionConfig:
     KEY_DERIVATION_ITERATIONS = 100000
     MASTER_KEY_PATH = '/etc/psyward/keys/master.key'
     
+    # Profiling (Flask-MonitoringDashboard, only bound when ENABLE_FMD is set)
+    # Set monitoring level 3 (profiler) on documents.upload and
+    # admin.system_status from the FMD UI; other endpoints stay at level 1
+    FMD_DATABASE_URI = os.environ.get('FMD_DATABASE_URI', 'sqlite:////mnt/encrypted_data/fmd.db')
+    
     # Resource limits for Pi Zero
     MAX_MEMORY_PERCENT = 80
     CPU_AFFINITY = [0]  # Single core
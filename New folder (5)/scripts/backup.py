@@ -12,7 +12,7 @@ from app import create_app
 from app.documents.storage import PatientStorageManager
 
 def main():
-    app = create_app('production')
+    app = create_app('production', start_samplers=False)
     
     with app.app_context():
         storage_mgr = PatientStorageManager()
@@ -37,6 +37,10 @@ sudo -u $SERVICE_USER ./venv/bin/pip install --upgrade pip
 # Install Python dependencies
 sudo -u $SERVICE_USER ./venv/bin/pip install -r requirements.txt
 
+# Rebuild Argon2 bindings for this CPU (generic wheels skip NEON on Pi Zero 2 W)
+sudo -u $SERVICE_USER env CFLAGS="-O3 -march=native" \
+    ./venv/bin/pip install --force-reinstall --no-binary argon2-cffi-bindings argon2-cffi-bindings
+
 # Set up environment
 sudo tee /etc/psyward/psyward.env << EOF
 FLASK_APP=app.py
@@ -20,13 +20,22 @@ WIPE_PATHS = [
     '/opt/psyward/instance'
 ]
 
+# Overwrite buffer size - keeps wipe memory constant on the 512MB Pi
+WIPE_CHUNK_SIZE = 1024 * 1024
+
 def secure_delete(path: Path):
     """Securely delete a file or directory"""
     if path.is_file():
-        # Overwrite file with random data
-        size = path.stat().st_size
-        with open(path, 'wb') as f:
-            f.write(os.urandom(size))
+        # Overwrite file with random data in place ('wb' would truncate
+        # first and the new data could land on different blocks)
+        remaining = path.stat().st_size
+        with open(path, 'r+b', buffering=0) as f:
+            while remaining:
+                n = min(WIPE_CHUNK_SIZE, remaining)
+                f.write(os.urandom(n))
+                remaining -= n
+            # Make sure the overwrite reaches the card before unlinking
+            os.fsync(f.fileno())
         os.unlink(path)
     elif path.is_dir():
         shutil.rmtree(path)
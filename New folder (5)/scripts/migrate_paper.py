@@ -15,38 +15,46 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import create_app, db
 from app.documents.processing import DocumentProcessor
-from app.patient.models import Patient
+from app.patient.models import Patient, PatientDocument
+
+# Document metadata updates are written this many rows at a time
+METADATA_BATCH_SIZE = 50
+
+# Documents in flight at once - the processor runs OCR one at a time, so
+# this only overlaps reading, resizing, encryption and DB work with it
+IMPORT_CONCURRENCY = 2
 
 async def import_batch(scan_dir: Path, mapping_file: Path):
     """Import scanned documents based on CSV mapping"""
-    app = create_app('production')
+    app = create_app('production', start_samplers=False)
     
     with app.app_context():
         processor = DocumentProcessor()
         
-        # Read mapping file
-        # Format: filename,patient_mrn,document_type,document_date
-        with open(mapping_file, 'r') as f:
-            reader = csv.DictReader(f)
+        # One query for every MRN instead of a lookup per row
+        patient_ids = dict(Patient.query.with_entities(Patient.mrn, Patient.id))
+        metadata_batch = []
+        slots = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        
+        async def import_one(row: dict):
+            filename = row['filename']
+            mrn = row['patient_mrn']
+            doc_type = row.get('document_type', 'scan')
+            doc_date = row.get('document_date')
             
-            for row in reader:
-                filename = row['filename']
-                mrn = row['patient_mrn']
-                doc_type = row.get('document_type', 'scan')
-                doc_date = row.get('document_date')
-                
-                file_path = scan_dir / filename
-                if not file_path.exists():
-                    print(f"File not found: {filename}")
-                    continue
-                
-                # Find patient
-                patient = Patient.query.filter_by(mrn=mrn).first()
-                if not patient:
-                    print(f"Patient not found: MRN {mrn}")
-                    continue
-                
-                print(f"Importing {filename} for patient {patient.full_name}...")
+            file_path = scan_dir / filename
+            if not file_path.exists():
+                print(f"File not found: {filename}")
+                return
+            
+            # Find patient
+            patient_id = patient_ids.get(mrn)
+            if patient_id is None:
+                print(f"Patient not found: MRN {mrn}")
+                return
+            
+            async with slots:
+                print(f"Importing {filename} for patient MRN {mrn}...")
                 
                 try:
                     # Process document
@@ -54,24 +62,43 @@ async def import_batch(scan_dir: Path, mapping_file: Path):
                         result = await processor.process_upload(
                             f,
                             filename,
-                            patient.id,
+                            patient_id,
                             1  # Admin user ID
                         )
                     
-                    # Update metadata
+                    # Queue metadata update
                     if doc_type or doc_date:
-                        from app.patient.models import PatientDocument
-                        doc = PatientDocument.query.get(result['document_id'])
+                        metadata = {'id': result['document_id']}
                         if doc_type:
-                            doc.document_type = doc_type
+                            metadata['document_type'] = doc_type
                         if doc_date:
-                            doc.document_date = datetime.strptime(doc_date, '%Y-%m-%d').date()
-                        db.session.commit()
+                            metadata['document_date'] = datetime.strptime(doc_date, '%Y-%m-%d').date()
+                        metadata_batch.append(metadata)
+                        
+                        if len(metadata_batch) >= METADATA_BATCH_SIZE:
+                            _flush_metadata(metadata_batch)
                     
-                    print(f"✓ Imported successfully (OCR confidence: {result['confidence']}%)")
+                    print(f"✓ Imported {filename} (OCR confidence: {result['confidence']}%)")
                     
                 except Exception as e:
-                    print(f"✗ Failed to import: {str(e)}")
+                    print(f"✗ Failed to import {filename}: {str(e)}")
+        
+        # Read mapping file
+        # Format: filename,patient_mrn,document_type,document_date
+        with open(mapping_file, 'r') as f:
+            rows = list(csv.DictReader(f))
+        
+        await asyncio.gather(*(import_one(row) for row in rows))
+        
+        _flush_metadata(metadata_batch)
+
+def _flush_metadata(metadata_batch: list):
+    """Write queued document metadata in one UPDATE batch and commit"""
+    if not metadata_batch:
+        return
+    db.session.bulk_update_mappings(PatientDocument, metadata_batch)
+    db.session.commit()
+    metadata_batch.clear()
 
 def main():
     parser = argparse.ArgumentParser(description='Import paper records to PSYWARD DMS')
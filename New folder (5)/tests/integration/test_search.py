@@ -0,0 +1,107 @@
+"""Tests for patient search"""
+from datetime import date
+import pytest
+from flask import Flask
+from app import db
+from app.auth import models as auth_models  # noqa: F401 - registers the users table
+from app.patient import search
+from app.patient.models import Patient
+from app.patient.search import PatientSearchEngine
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', TESTING=True)
+    db.init_app(app)
+    # Search logging goes to the audit file; not under test here
+    monkeypatch.setattr(search, 'log_search_event', lambda *args, **kwargs: None)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _add_patients(*names, is_active=True):
+    """Add patients from (first, last) pairs"""
+    for i, (first, last) in enumerate(names):
+        db.session.add(Patient(
+            mrn=f"{'A' if is_active else 'I'}{i:06d}",
+            first_name=first,
+            last_name=last,
+            date_of_birth=date(1980, 1, 1),
+            is_active=is_active
+        ))
+    db.session.commit()
+
+
+def _names(patients):
+    return {(p.first_name, p.last_name) for p in patients}
+
+
+def test_last_name_and_first_name_prefix_hits_together(app):
+    _add_patients(('John', 'Smith'), ('Jo', 'Doe'), ('Smith', 'John'), ('Alice', 'Brown'))
+
+    results = PatientSearchEngine.search_patients('jo', user_id=1)
+
+    assert _names(results) == {('John', 'Smith'), ('Jo', 'Doe'), ('Smith', 'John')}
+
+
+def test_last_name_prefix_is_case_insensitive(app):
+    _add_patients(('Mary', 'OConnor'), ('Oscar', 'Wilde'))
+
+    results = PatientSearchEngine.search_patients('OCON', user_id=1)
+
+    assert _names(results) == {('Mary', 'OConnor')}
+
+
+def test_full_name_query_matches_joined_name(app):
+    _add_patients(('John', 'Smith'), ('John', 'Doe'))
+
+    results = PatientSearchEngine.search_patients('john sm', user_id=1)
+
+    assert _names(results) == {('John', 'Smith')}
+
+
+def test_substring_matches_fill_remaining_slots(app):
+    _add_patients(('Jo', 'Doe'), ('Ajoy', 'Kumar'))
+
+    results = PatientSearchEngine.search_patients('jo', user_id=1)
+
+    # Prefix hits first, then substring-only hits, no duplicates
+    assert [(p.first_name, p.last_name) for p in results] == [('Jo', 'Doe'), ('Ajoy', 'Kumar')]
+
+
+def test_results_capped_at_limit(app, monkeypatch):
+    monkeypatch.setattr(PatientSearchEngine, 'PATIENT_RESULT_LIMIT', 2)
+    _add_patients(('Jo', 'A'), ('Jo', 'B'), ('Ajo', 'C'))
+
+    results = PatientSearchEngine.search_patients('jo', user_id=1)
+
+    assert len(results) == 2
+
+
+def test_mrn_exact_match(app):
+    _add_patients(('John', 'Smith'), ('Jane', 'Doe'))
+
+    results = PatientSearchEngine.search_patients('a000001', user_id=1)
+
+    assert _names(results) == {('Jane', 'Doe')}
+
+
+def test_inactive_patients_excluded_by_default(app):
+    _add_patients(('John', 'Smith'))
+    _add_patients(('Joan', 'Smythe'), is_active=False)
+
+    assert _names(PatientSearchEngine.search_patients('jo', user_id=1)) == {('John', 'Smith')}
+    assert len(PatientSearchEngine.search_patients('jo', user_id=1, include_inactive=True)) == 2
+
+
+def test_like_wildcards_in_query_are_literal(app):
+    _add_patients(('Anna', 'Bell'), ('A_na', 'Bell'))
+
+    results = PatientSearchEngine.search_patients('a_n', user_id=1)
+
+    assert _names(results) == {('A_na', 'Bell')}
@@ -0,0 +1,198 @@
+"""Tests for chunked AEAD file encryption"""
+import os
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from app.auth.security import (
+    FileEncryption, generate_file_key, ALG_AES_256_GCM, ALG_CHACHA20_POLY1305,
+    FILE_MAGIC, AEAD_TAG_SIZE, LEGACY_NONCE_SIZE, _HEADER_SIZE
+)
+
+# Small chunks so multi-chunk files stay tiny
+CHUNK_SIZE = 64
+SIZES = [0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 3 * CHUNK_SIZE, 3 * CHUNK_SIZE + 7]
+ALGORITHMS = [ALG_AES_256_GCM, ALG_CHACHA20_POLY1305]
+
+
+@pytest.fixture
+def key():
+    return generate_file_key()
+
+
+def _write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def _encrypt(enc: FileEncryption, tmp_path, data: bytes) -> str:
+    """Encrypt data to a file and return its path"""
+    source = _write(tmp_path / 'plain', data)
+    output = str(tmp_path / 'sealed')
+    enc.encrypt_file(source, output, chunk_size=CHUNK_SIZE)
+    return output
+
+
+def _decrypt(enc: FileEncryption, tmp_path, sealed: str) -> bytes:
+    """Decrypt a sealed file and return the plaintext"""
+    output = str(tmp_path / 'opened')
+    enc.decrypt_file(sealed, output, chunk_size=CHUNK_SIZE)
+    with open(output, 'rb') as f:
+        return f.read()
+
+
+def _sealed_chunks(sealed: str):
+    """Split a sealed file into (header, [sealed chunks])"""
+    with open(sealed, 'rb') as f:
+        blob = f.read()
+    step = CHUNK_SIZE + AEAD_TAG_SIZE
+    body = blob[_HEADER_SIZE:]
+    return blob[:_HEADER_SIZE], [body[i:i + step] for i in range(0, len(body), step)]
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+@pytest.mark.parametrize('size', SIZES)
+def test_file_round_trip_at_chunk_boundaries(tmp_path, key, algorithm, size):
+    enc = FileEncryption(key, algorithm)
+    data = os.urandom(size)
+
+    sealed = _encrypt(enc, tmp_path, data)
+
+    assert _decrypt(enc, tmp_path, sealed) == data
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_header_records_algorithm(tmp_path, key, algorithm):
+    sealed = _encrypt(FileEncryption(key, algorithm), tmp_path, b'x' * 10)
+    header, _ = _sealed_chunks(sealed)
+
+    assert header.startswith(FILE_MAGIC)
+    assert header[len(FILE_MAGIC)] == algorithm
+    # Header alone picks the cipher, whatever the reader's default
+    other = ALG_CHACHA20_POLY1305 if algorithm == ALG_AES_256_GCM else ALG_AES_256_GCM
+    assert _decrypt(FileEncryption(key, other), tmp_path, sealed) == b'x' * 10
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_chunks_use_distinct_nonces(tmp_path, key, algorithm):
+    # Identical plaintext chunks must not produce identical ciphertext
+    sealed = _encrypt(FileEncryption(key, algorithm), tmp_path, b'\0' * (3 * CHUNK_SIZE))
+    _, chunks = _sealed_chunks(sealed)
+
+    assert len(set(chunks)) == len(chunks)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_dropped_final_chunk_is_detected(tmp_path, key, algorithm):
+    enc = FileEncryption(key, algorithm)
+    sealed = _encrypt(enc, tmp_path, os.urandom(3 * CHUNK_SIZE))
+    header, chunks = _sealed_chunks(sealed)
+
+    # Cut on a chunk boundary - every remaining chunk is individually valid
+    _write(tmp_path / 'sealed', header + b''.join(chunks[:-1]))
+
+    with pytest.raises(InvalidTag):
+        _decrypt(enc, tmp_path, sealed)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_truncated_chunk_is_detected(tmp_path, key, algorithm):
+    enc = FileEncryption(key, algorithm)
+    sealed = _encrypt(enc, tmp_path, os.urandom(2 * CHUNK_SIZE + 5))
+    with open(sealed, 'rb') as f:
+        blob = f.read()
+
+    _write(tmp_path / 'sealed', blob[:-3])
+
+    with pytest.raises(InvalidTag):
+        _decrypt(enc, tmp_path, sealed)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_reordered_chunks_are_detected(tmp_path, key, algorithm):
+    enc = FileEncryption(key, algorithm)
+    sealed = _encrypt(enc, tmp_path, os.urandom(3 * CHUNK_SIZE + 1))
+    header, chunks = _sealed_chunks(sealed)
+
+    chunks[0], chunks[1] = chunks[1], chunks[0]
+    _write(tmp_path / 'sealed', header + b''.join(chunks))
+
+    with pytest.raises(InvalidTag):
+        _decrypt(enc, tmp_path, sealed)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_tampered_chunk_is_detected(tmp_path, key, algorithm):
+    enc = FileEncryption(key, algorithm)
+    sealed = _encrypt(enc, tmp_path, os.urandom(2 * CHUNK_SIZE))
+    with open(sealed, 'rb') as f:
+        blob = bytearray(f.read())
+
+    blob[_HEADER_SIZE + 3] ^= 0x01
+    _write(tmp_path / 'sealed', bytes(blob))
+
+    with pytest.raises(InvalidTag):
+        _decrypt(enc, tmp_path, sealed)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+@pytest.mark.parametrize('size', SIZES)
+def test_writer_matches_file_layout(tmp_path, key, algorithm, size):
+    enc = FileEncryption(key, algorithm)
+    data = os.urandom(size)
+    sealed = str(tmp_path / 'sealed')
+
+    # Uneven writes so chunk boundaries fall mid-write
+    with enc.open_writer(sealed, chunk_size=CHUNK_SIZE) as writer:
+        for start in range(0, size, 37):
+            writer.write(data[start:start + 37])
+
+    assert writer.closed
+    assert _decrypt(enc, tmp_path, sealed) == data
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_writer_aborted_by_exception_fails_decryption(tmp_path, key, algorithm):
+    enc = FileEncryption(key, algorithm)
+    sealed = str(tmp_path / 'sealed')
+
+    with pytest.raises(RuntimeError):
+        with enc.open_writer(sealed, chunk_size=CHUNK_SIZE) as writer:
+            writer.write(os.urandom(3 * CHUNK_SIZE))
+            raise RuntimeError('backup interrupted')
+
+    # No final chunk was written, so the partial file can't pass as complete
+    with pytest.raises(InvalidTag):
+        _decrypt(enc, tmp_path, sealed)
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_bytes_round_trip(key, algorithm):
+    enc = FileEncryption(key, algorithm)
+
+    for data in (b'', b'OCR text', os.urandom(5000)):
+        assert enc.decrypt_bytes(enc.encrypt_bytes(data)) == data
+
+
+def test_legacy_bytes_decrypt(key):
+    nonce = os.urandom(LEGACY_NONCE_SIZE)
+    blob = nonce + AESGCM(key).encrypt(nonce, b'legacy text', None)
+
+    assert FileEncryption(key, ALG_CHACHA20_POLY1305).decrypt_bytes(blob) == b'legacy text'
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_legacy_file_decrypts(tmp_path, key, size):
+    # Legacy layout: nonce || AES-GCM chunks all sealed with that one nonce
+    data = os.urandom(size)
+    nonce = os.urandom(LEGACY_NONCE_SIZE)
+    aead = AESGCM(key)
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    sealed = _write(tmp_path / 'sealed',
+                    nonce + b''.join(aead.encrypt(nonce, chunk, None) for chunk in chunks))
+
+    assert _decrypt(FileEncryption(key), tmp_path, sealed) == data
+
+
+def test_unknown_algorithm_rejected(key):
+    with pytest.raises(ValueError):
+        FileEncryption(key, 99)
@@ -0,0 +1,93 @@
+"""Tests for session validation cache invalidation"""
+from datetime import timedelta
+import pytest
+from flask import Flask
+from app import db
+from app.auth import security
+from app.auth.models import User, UserSession
+from app.auth.security import SessionManager
+
+IP = '10.0.0.5'
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        PERMANENT_SESSION_LIFETIME=timedelta(hours=1),
+        TESTING=True
+    )
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        security._session_cache.clear()
+        security._pending_activity.clear()
+
+
+@pytest.fixture
+def user(app):
+    user = User(email='nurse@example.org', username='nurse', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _login(user) -> str:
+    session_id = SessionManager.create_session(user.id, IP, 'pytest')
+    db.session.commit()
+    # Validate once so the session is cached
+    assert SessionManager.validate_session(session_id, IP) == user.id
+    return session_id
+
+
+def test_end_session_stops_cached_session(user):
+    session_id = _login(user)
+
+    SessionManager.end_session(session_id)
+
+    assert SessionManager.validate_session(session_id, IP) is None
+
+
+def test_end_user_sessions_revokes_all(user):
+    first, second = _login(user), _login(user)
+
+    assert SessionManager.end_user_sessions(user.id) == 2
+
+    assert SessionManager.validate_session(first, IP) is None
+    assert SessionManager.validate_session(second, IP) is None
+
+
+def test_end_user_sessions_leaves_other_users(user):
+    other = User(email='doc@example.org', username='doc', password_hash='x')
+    db.session.add(other)
+    db.session.commit()
+    mine, theirs = _login(user), _login(other)
+
+    SessionManager.end_user_sessions(user.id)
+
+    assert SessionManager.validate_session(mine, IP) is None
+    assert SessionManager.validate_session(theirs, IP) == other.id
+
+
+def test_password_change_ends_sessions(user, monkeypatch):
+    # Hashing itself isn't under test (and Argon2 is slow)
+    monkeypatch.setattr('app.auth.models.hash_password', lambda password: 'hashed')
+    session_id = _login(user)
+
+    user.set_password('new password')
+
+    assert SessionManager.validate_session(session_id, IP) is None
+
+
+def test_orm_delete_stops_cached_session(user):
+    session_id = _login(user)
+
+    db.session.delete(db.session.get(UserSession, session_id))
+    db.session.commit()
+
+    assert SessionManager.validate_session(session_id, IP) is None